@@ -0,0 +1,205 @@
+"""
+Benchmark de punta a punta contra el Floodlight simulado.
+
+Genera una base YAML grande y una topología sintética coherente con ella,
+levanta floodlight_simulado.py en un puerto libre y mide:
+
+- importación/exportación de la base (YAML y snapshot)
+- throughput de verificación de políticas
+- creación y eliminación de conexiones una por una (conexiones/s, p50, p99)
+- aprovisionamiento en lote
+
+Con --controladores N los switches se reparten entre N controladores
+simulados y laboratorio6 los usa a través de su registro de controladores.
+
+Los resultados se escriben en JSON para compararlos entre commits.
+
+Uso:
+    python benchmark.py --alumnos 20000 --cursos 200 --conexiones 300 --salida bench_results.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+import yaml
+
+import floodlight_simulado as fs
+
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def resumen_latencias(latencias: List[float], duracion: float) -> Dict[str, float]:
+    return {
+        'operaciones': len(latencias),
+        'por_segundo': len(latencias) / duracion if duracion else 0.0,
+        'p50_ms': percentil(latencias, 50) * 1000,
+        'p99_ms': percentil(latencias, 99) * 1000,
+    }
+
+
+def generar_base(n_alumnos: int, n_cursos: int, n_servidores: int, alumnos_por_curso: int,
+                 semilla: int = 354) -> Dict[str, Any]:
+    """Base con el esquema de database.yaml, coherente con fs.generar_dispositivos."""
+    azar = random.Random(semilla)
+    alumnos = [{'codigo': 20000000 + i, 'mac': fs.mac_sintetica(i), 'nombre': f"Alumno {i}"}
+               for i in range(n_alumnos)]
+    servidores = [{'nombre': f"Servidor {i + 1}", 'ip': fs.ip_sintetica(i, 172),
+                   'servicios': [{'nombre': 'ssh', 'protocolo': 'TCP', 'puerto': 22},
+                                 {'nombre': 'web', 'protocolo': 'TCP', 'puerto': 80}]}
+                  for i in range(n_servidores)]
+    cursos = []
+    for i in range(n_cursos):
+        inscritos = azar.sample(range(n_alumnos), min(alumnos_por_curso, n_alumnos))
+        cursos.append({
+            'codigo': f"TEL{100 + i}",
+            'estado': 'DICTANDO' if i % 4 else 'INACTIVO',
+            'nombre': f"Curso {i}",
+            'alumnos': [20000000 + j for j in inscritos],
+            'servidores': [{'nombre': f"Servidor {i % n_servidores + 1}", 'servicios_permitidos': ['ssh', 'web']}],
+        })
+    return {'alumnos': alumnos, 'cursos': cursos, 'servidores': servidores}
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta")
+    parser.add_argument("--alumnos", type=int, default=20000)
+    parser.add_argument("--cursos", type=int, default=200)
+    parser.add_argument("--servidores", type=int, default=10)
+    parser.add_argument("--alumnos-por-curso", type=int, default=60)
+    parser.add_argument("--switches", type=int, default=16)
+    parser.add_argument("--controladores", type=int, default=1, help="controladores simulados entre los que se reparten los switches")
+    parser.add_argument("--conexiones", type=int, default=200, help="conexiones creadas una por una")
+    parser.add_argument("--lote", type=int, default=1000, help="conexiones del aprovisionamiento en lote")
+    parser.add_argument("--consultas", type=int, default=200000, help="tuplas de la verificación de políticas")
+    parser.add_argument("--latencia", type=float, default=0.0, help="latencia del controlador simulado (s)")
+    parser.add_argument("--errores", type=float, default=0.0, help="tasa de errores inyectados")
+    parser.add_argument("--salida", default="bench_results.json")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_")
+    os.environ["CONEXIONES_DB"] = os.path.join(directorio, "conexiones.db")
+    # El switch i pertenece al controlador i % N; cada uno informa sus hosts y los enlaces que salen de sus switches
+    dispositivos = fs.generar_dispositivos(args.alumnos, args.servidores, args.switches)
+    enlaces = fs.generar_enlaces(args.switches)
+    n = max(1, args.controladores)
+    dpids = [[fs.dpid_sintetico(i) for i in range(args.switches) if i % n == k] for k in range(n)]
+    estados, servidores_http = [], []
+    for k in range(n):
+        propios = set(dpids[k])
+        estado = fs.FloodlightSimulado([d for d in dispositivos if d["attachmentPoint"][0]["switchDPID"] in propios],
+                                       args.latencia, args.errores, semilla=1 + k,
+                                       enlaces=[e for e in enlaces if e["src-switch"] in propios])
+        estados.append(estado)
+        servidores_http.append(fs.iniciar(estado))
+    urls = [f"http://127.0.0.1:{s.server_address[1]}" for s in servidores_http]
+    os.environ["FLOODLIGHT_URL"] = urls[0]
+
+    import laboratorio6 as lab
+    if n > 1:
+        archivo_controladores = os.path.join(directorio, "controladores.yaml")
+        with open(archivo_controladores, 'w') as f:
+            yaml.dump({'controladores': [{'nombre': f"c{k + 1}", 'url': urls[k], 'dpids': dpids[k]}
+                                         for k in range(n)]}, f)
+        lab.cargar_controladores(archivo_controladores)
+
+    resultados: Dict[str, Any] = {}
+    base = generar_base(args.alumnos, args.cursos, args.servidores, args.alumnos_por_curso)
+    archivo_yaml = os.path.join(directorio, "database.yaml")
+    with open(archivo_yaml, 'w') as f:
+        yaml.dump(base, f, Dumper=lab.YamlDumper)
+
+    # Importación / exportación
+    resultados['importar_yaml_s'] = lab.importar_base(archivo_yaml)['duracion']
+    resultados['exportar_yaml_s'] = lab.exportar_base(os.path.join(directorio, "salida.yaml"))['duracion']
+    archivo_snap = os.path.join(directorio, "database" + lab.EXT_SNAPSHOT)
+    resultados['exportar_snapshot_s'] = lab.exportar_base(archivo_snap)['duracion']
+    resultados['importar_snapshot_s'] = lab.importar_base(archivo_snap)['duracion']
+
+    # Verificación de políticas
+    azar = random.Random(7)
+    consultas = [(20000000 + azar.randrange(args.alumnos), f"Servidor {azar.randrange(args.servidores) + 1}",
+                  azar.choice(('ssh', 'web'))) for _ in range(args.consultas)]
+    inicio = time.perf_counter()
+    permitidas = lab.indice_politicas.consultar_lote(consultas)
+    duracion = time.perf_counter() - inicio
+    resultados['politicas'] = {'consultas': len(consultas), 'por_segundo': len(consultas) / duracion,
+                               'permitidas': sum(permitidas)}
+
+    # Candidatas: tuplas permitidas, sin repetir
+    candidatas = list(dict.fromkeys(t for t, ok in zip(consultas, permitidas) if ok))
+    individuales = candidatas[:args.conexiones]
+    en_lote = candidatas[args.conexiones:args.conexiones + args.lote]
+
+    # Creación una por una
+    latencias, handlers = [], []
+    inicio = time.perf_counter()
+    for alumno, servidor, servicio in individuales:
+        t = time.perf_counter()
+        try:
+            handlers.append(lab.abrir_conexion(alumno, servidor, servicio)['handler'])
+        except lab.OperacionInvalida:
+            continue
+        latencias.append(time.perf_counter() - t)
+    resultados['crear_conexion'] = resumen_latencias(latencias, time.perf_counter() - inicio)
+
+    # Aprovisionamiento en lote
+    inicio = time.perf_counter()
+    lote = lab.crear_conexiones_lote(en_lote) if en_lote else []
+    duracion = time.perf_counter() - inicio
+    resultados['lote'] = {'solicitudes': len(en_lote), 'exitosas': sum(1 for r in lote if r['ok']),
+                          'duracion_s': duracion,
+                          'por_segundo': len(en_lote) / duracion if duracion else 0.0}
+
+    # Eliminación una por una
+    latencias = []
+    inicio = time.perf_counter()
+    for handler in handlers:
+        t = time.perf_counter()
+        lab.eliminar_conexion(handler)
+        latencias.append(time.perf_counter() - t)
+    resultados['eliminar_conexion'] = resumen_latencias(latencias, time.perf_counter() - inicio)
+
+    resultados['controlador'] = {'peticiones': sum(e.peticiones for e in estados),
+                                 'errores_inyectados': sum(e.errores_inyectados for e in estados),
+                                 'flows_instalados': sum(len(e.flows) for e in estados)}
+    resultados['cache_dispositivos'] = lab.cache_dispositivos.estadisticas()
+    resultados['topologia'] = lab.topologia.estadisticas()
+    resultados['metricas'] = {op: {k: v for k, v in m.items() if k != 'buckets'}
+                              for op, m in lab.ver_metricas()['operaciones'].items()}
+
+    reporte = {
+        'commit': commit_actual(),
+        'fecha': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0],
+        'parametros': vars(args),
+        'resultados': resultados,
+    }
+    with open(args.salida, 'w') as f:
+        json.dump(reporte, f, indent=2)
+    print(json.dumps(resultados, indent=2))
+    print(f"Resultados escritos en {args.salida}")
+    for servidor_http in servidores_http:
+        servidor_http.shutdown()
+
+
+if __name__ == "__main__":
+    main()
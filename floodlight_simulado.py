@@ -0,0 +1,212 @@
+"""
+Floodlight simulado para pruebas y benchmarks locales.
+
+Implementa el subconjunto de la API REST que usa laboratorio6.py:
+
+    GET    /wm/device/
+    POST   /wm/staticflowpusher/json
+    DELETE /wm/staticflowpusher/json
+    GET    /wm/staticflowpusher/list/<dpid|all>/json
+    GET    /wm/topology/links/json
+
+con latencia configurable, inyección de errores y topologías sintéticas de
+miles de dispositivos.
+
+Uso:
+    python floodlight_simulado.py --puerto 8080 --dispositivos 5000 --latencia 0.002 --errores 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional
+
+
+def mac_sintetica(i: int, prefijo: int = 0x44) -> str:
+    return f"{prefijo:02x}:11:{(i >> 24) & 0xff:02x}:{(i >> 16) & 0xff:02x}:{(i >> 8) & 0xff:02x}:{i & 0xff:02x}"
+
+
+def ip_sintetica(i: int, red: int = 10) -> str:
+    n = i + 1
+    return f"{red}.{(n >> 16) & 0xff}.{(n >> 8) & 0xff}.{n & 0xff}"
+
+
+def dpid_sintetico(i: int) -> str:
+    return ":".join(f"{b:02x}" for b in (i + 1).to_bytes(8, "big"))
+
+
+def generar_dispositivos(n_alumnos: int, n_servidores: int, n_switches: int = 16,
+                         puertos_por_switch: int = 48) -> List[Dict[str, Any]]:
+    """
+    Topología sintética: alumnos y servidores repartidos en `n_switches`
+    switches. Los alumnos usan mac_sintetica(i) e ip_sintetica(i); los
+    servidores mac_sintetica(i, 0x5e) e ip_sintetica(i, 172).
+    """
+    dispositivos = []
+    for i in range(n_alumnos):
+        dispositivos.append({
+            "mac": [mac_sintetica(i)],
+            "ipv4": [ip_sintetica(i)],
+            "attachmentPoint": [{"switchDPID": dpid_sintetico(i % n_switches),
+                                 "port": 2 + (i // n_switches) % (puertos_por_switch - 1)}],
+        })
+    for i in range(n_servidores):
+        dispositivos.append({
+            "mac": [mac_sintetica(i, 0x5e)],
+            "ipv4": [ip_sintetica(i, 172)],
+            "attachmentPoint": [{"switchDPID": dpid_sintetico(i % n_switches), "port": 1}],
+        })
+    return dispositivos
+
+
+def generar_enlaces(n_switches: int, puertos_por_switch: int = 48) -> List[Dict[str, Any]]:
+    """
+    Enlaces de un árbol binario de switches: el switch i cuelga de (i - 1) // 2.
+    Los puertos de enlace empiezan después de los puertos de hosts.
+    """
+    enlaces = []
+    for i in range(1, n_switches):
+        padre = (i - 1) // 2
+        enlaces.append({
+            "src-switch": dpid_sintetico(i), "src-port": puertos_por_switch + 1,
+            "dst-switch": dpid_sintetico(padre), "dst-port": puertos_por_switch + 2 + (i - 1) % 2,
+            "type": "internal", "direction": "bidirectional", "latency": 0,
+        })
+    return enlaces
+
+
+class FloodlightSimulado:
+    """Estado del controlador simulado: dispositivos, enlaces, static flows y parámetros de falla."""
+    def __init__(self, dispositivos: Optional[List[dict]] = None, latencia: float = 0.0,
+                 tasa_error: float = 0.0, semilla: Optional[int] = None, enlaces: Optional[List[dict]] = None):
+        self.dispositivos = dispositivos or []
+        self.enlaces = enlaces or []
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self.flows: Dict[str, dict] = {}
+        self.peticiones = 0
+        self.errores_inyectados = 0
+        self._lock = threading.Lock()
+        self._azar = random.Random(semilla)
+
+    def _simular_red(self) -> bool:
+        """Aplica la latencia y decide si la petición falla. Devuelve True si debe fallar."""
+        with self._lock:
+            self.peticiones += 1
+            falla = self._azar.random() < self.tasa_error
+            if falla:
+                self.errores_inyectados += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        return falla
+
+    def agregar_flow(self, flow: dict):
+        with self._lock:
+            self.flows[flow["name"]] = flow
+
+    def eliminar_flow(self, nombre: str) -> bool:
+        with self._lock:
+            return self.flows.pop(nombre, None) is not None
+
+    def listar_flows(self, dpid: str = "all") -> Dict[str, List[dict]]:
+        with self._lock:
+            flows = list(self.flows.values())
+        listado: Dict[str, List[dict]] = {}
+        for flow in flows:
+            if dpid in ("all", flow.get("switch")):
+                listado.setdefault(flow.get("switch"), []).append({flow["name"]: flow})
+        return listado
+
+
+def _crear_handler(estado: FloodlightSimulado):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # sin esto keep-alive suma ~40 ms por petición
+
+        def log_message(self, *args):
+            pass
+
+        def _leer_json(self):
+            largo = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(largo) or b"null")
+
+        def _responder(self, estado_http: int, cuerpo):
+            data = json.dumps(cuerpo).encode()
+            self.send_response(estado_http)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            falla = estado._simular_red()
+            if falla:
+                return self._responder(503, {"status": "error inyectado"})
+            if self.path.rstrip("/") == "/wm/device":
+                return self._responder(200, estado.dispositivos)
+            if self.path == "/wm/topology/links/json":
+                return self._responder(200, estado.enlaces)
+            partes = self.path.strip("/").split("/")
+            if partes[:3] == ["wm", "staticflowpusher", "list"] and len(partes) == 5:
+                return self._responder(200, estado.listar_flows(partes[3]))
+            self._responder(404, {"status": "ruta desconocida"})
+
+        def do_POST(self):
+            cuerpo = self._leer_json() if self.headers.get("Content-Length") else None
+            if estado._simular_red():
+                return self._responder(503, {"status": "error inyectado"})
+            if self.path != "/wm/staticflowpusher/json":
+                return self._responder(404, {"status": "ruta desconocida"})
+            if not isinstance(cuerpo, dict) or not cuerpo.get("name") or not cuerpo.get("switch"):
+                return self._responder(400, {"status": "Error! Flow sin 'name' o 'switch'"})
+            estado.agregar_flow(cuerpo)
+            self._responder(200, {"status": "Entry pushed"})
+
+        def do_DELETE(self):
+            cuerpo = self._leer_json() if self.headers.get("Content-Length") else None
+            if estado._simular_red():
+                return self._responder(503, {"status": "error inyectado"})
+            if self.path != "/wm/staticflowpusher/json":
+                return self._responder(404, {"status": "ruta desconocida"})
+            if not isinstance(cuerpo, dict) or not cuerpo.get("name"):
+                return self._responder(400, {"status": "Error! Falta 'name'"})
+            estado.eliminar_flow(cuerpo["name"])
+            self._responder(200, {"status": f"Entry {cuerpo['name']} deleted"})
+
+    return Handler
+
+
+def iniciar(estado: FloodlightSimulado, host: str = "127.0.0.1", puerto: int = 0) -> ThreadingHTTPServer:
+    """Levanta el servidor en un hilo; con puerto 0 el sistema elige uno libre (ver server_address)."""
+    servidor = ThreadingHTTPServer((host, puerto), _crear_handler(estado))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Floodlight simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--dispositivos", type=int, default=1000, help="alumnos sintéticos")
+    parser.add_argument("--servidores", type=int, default=10)
+    parser.add_argument("--switches", type=int, default=16)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por petición")
+    parser.add_argument("--errores", type=float, default=0.0, help="probabilidad de responder 503")
+    args = parser.parse_args()
+
+    estado = FloodlightSimulado(generar_dispositivos(args.dispositivos, args.servidores, args.switches),
+                                args.latencia, args.errores, enlaces=generar_enlaces(args.switches))
+    servidor = iniciar(estado, args.host, args.puerto)
+    print(f"Floodlight simulado en http://{args.host}:{servidor.server_address[1]} "
+          f"({len(estado.dispositivos)} dispositivos)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
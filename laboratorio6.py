@@ -1,21 +1,627 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import cProfile
+import csv
+import functools
+import hashlib
+import heapq
+import inspect
+import itertools
 import json
+import os
+import pickle
+import pstats
+import re
+import sqlite3
+import sys
+import threading
+import time
 import yaml
 import requests
 import uuid
-from typing import List, Dict, Optional, Any
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Loader/Dumper en C (libyaml) cuando PyYAML fue compilado con él
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+from typing import List, Dict, Optional, Any, Iterable, Tuple
 
 # Floodlight controller configuration
 CONTROLLER_IP = "192.168.200.200"
 CONTROLLER_PORT = 8080
 CONTROLLER_URL = f"http://{CONTROLLER_IP}:{CONTROLLER_PORT}"
 
-conexiones = []
 
-BASE_URL = f"http://{CONTROLLER_IP}:8080"
+# FLOODLIGHT_URL permite apuntar a otro controlador (p. ej. floodlight_simulado.py)
+BASE_URL = os.environ.get("FLOODLIGHT_URL", f"http://{CONTROLLER_IP}:8080")
+# Archivo YAML/JSON con varios controladores y los DPIDs de cada uno (opcional)
+CONTROLADORES_CONFIG = os.environ.get("FLOODLIGHT_CONTROLADORES")
 HEADERS = {'Content-Type': 'application/json'}
 
+# Cliente HTTP hacia Floodlight: (connect, read) en segundos, reintentos y tamaño del pool
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_REINTENTOS = 3
+HTTP_BACKOFF = 0.3
+HTTP_POOL = 16
+
+# Vigencia (segundos) de la caché de dispositivos de /wm/device/
+DEVICE_CACHE_TTL = 30
+
+# Cada cuánto (s) se vuelve a consultar la lista de enlaces entre switches
+TOPOLOGIA_TTL = 30
+
+# Snapshots binarios de la base (pickle con versión de esquema)
+EXT_SNAPSHOT = ".snap"
+SNAPSHOT_VERSION = 2
+# Firma del snapshot de caché <base>.snap: sin ella importar un YAML no lo usa
+EXT_FIRMA = ".firma"
+
+# Elementos por llamada a yaml.dump al exportar por secciones
+YAML_BLOQUE_EXPORT = 1000
+
+# Diario de cambios junto a la base (<base>.diario, un JSON por línea) y
+# número de entradas a partir del cual se compacta en segundo plano
+EXT_DIARIO = ".diario"
+DIARIO_MAX_ENTRADAS = 500
+
+# Base SQLite donde persisten las conexiones activas y sus flows
+CONEXIONES_DB = os.environ.get("CONEXIONES_DB", "conexiones.db")
+
+# Intervalo (segundos) por defecto de la reconciliación periódica
+RECONCILIACION_INTERVALO = 300
+
+# Modo de agregación: flows compartidos entre conexiones en vez de 4 flows por handler
+MODO_AGREGACION = os.environ.get("MODO_AGREGACION") == "1"
+
+# Cookie con la que esta herramienta marca sus flows ("LAB6" en los 32 bits
+# altos); la reconciliación solo borra flows que la llevan
+COOKIE_FLOWS = 0x4C414236 << 32
+
+# Dirección por defecto de la API JSON-RPC local
+API_HOST = "127.0.0.1"
+API_PUERTO = 8081
+
+# Número de peticiones de flows simultáneas a un controlador
+MAX_WORKERS_LOTE = 8
+
+# Matrículas a partir de las cuales la auditoría reparte el trabajo en procesos
+AUDITORIA_UMBRAL_PROCESOS = 200000
+
+# Planificador de flows: tasa máxima (token bucket), ráfaga y tamaño de la cola
+FLOWS_POR_SEGUNDO = float(os.environ.get("FLOWS_POR_SEGUNDO", 500))
+FLOWS_RAFAGA = 50
+FLOWS_MAX_COLA = 5000
+
+# Prioridades de la cola de flows (menor sale antes)
+PRIORIDAD_ELIMINAR = 0   # revocaciones, reversiones y eliminaciones
+PRIORIDAD_CREAR = 1      # conexiones individuales
+PRIORIDAD_LOTE = 2       # aprovisionamiento masivo
+
+# Límites (segundos) de los histogramas de latencia
+METRICAS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """Histograma acumulativo al estilo Prometheus: conteo por límite superior, suma y total."""
+    __slots__ = ('conteos', 'suma', 'total')
+
+    def __init__(self):
+        self.conteos = [0] * (len(METRICAS_BUCKETS) + 1)  # el último es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.conteos[bisect.bisect_left(METRICAS_BUCKETS, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def acumulados(self) -> List[int]:
+        return list(itertools.accumulate(self.conteos))
+
+    def percentil(self, p: float) -> float:
+        """Aproximación por límite de bucket (lo que haría histogram_quantile)."""
+        if not self.total:
+            return 0.0
+        objetivo = p / 100 * self.total
+        for limite, acumulado in zip(METRICAS_BUCKETS + (float('inf'),), self.acumulados()):
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+
+class Metricas:
+    """
+    Métricas de las rutas calientes: latencia, llamadas, errores y operaciones
+    en vuelo por nombre de operación. Seguro entre hilos (el lote y la API
+    instalan flows desde un pool).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histogramas: Dict[str, Histograma] = {}
+        self.llamadas: Dict[str, int] = {}
+        self.errores: Dict[str, int] = {}
+        self.en_vuelo: Dict[str, int] = {}
+        self.inicio = time.time()
+
+    @contextlib.contextmanager
+    def medir(self, operacion: str):
+        """Span: mide la duración del bloque y cuenta como error si lanza una excepción."""
+        with self._lock:
+            self.en_vuelo[operacion] = self.en_vuelo.get(operacion, 0) + 1
+        inicio = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self.en_vuelo[operacion] -= 1
+                self.llamadas[operacion] = self.llamadas.get(operacion, 0) + 1
+                if error:
+                    self.errores[operacion] = self.errores.get(operacion, 0) + 1
+                if operacion not in self.histogramas:
+                    self.histogramas[operacion] = Histograma()
+                self.histogramas[operacion].observar(duracion)
+
+    def error(self, operacion: str):
+        with self._lock:
+            self.errores[operacion] = self.errores.get(operacion, 0) + 1
+
+    def reiniciar(self):
+        with self._lock:
+            self.histogramas.clear()
+            self.llamadas.clear()
+            self.errores.clear()
+            self.en_vuelo = {op: n for op, n in self.en_vuelo.items() if n}
+            self.inicio = time.time()
+
+    def como_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            operaciones = {}
+            for op, hist in self.histogramas.items():
+                operaciones[op] = {
+                    'llamadas': self.llamadas.get(op, 0),
+                    'errores': self.errores.get(op, 0),
+                    'en_vuelo': self.en_vuelo.get(op, 0),
+                    'segundos_total': hist.suma,
+                    'promedio_ms': hist.suma / hist.total * 1000 if hist.total else 0.0,
+                    'p50_ms': hist.percentil(50) * 1000,
+                    'p99_ms': hist.percentil(99) * 1000,
+                    'buckets': {str(limite): n for limite, n in
+                                zip(METRICAS_BUCKETS + ('+Inf',), hist.acumulados())},
+                }
+            return {'desde': self.inicio, 'operaciones': operaciones}
+
+    def exportar_prometheus(self) -> str:
+        """Formato de texto 0.0.4 de Prometheus."""
+        lineas = [
+            "# HELP lab6_operacion_segundos Latencia de las operaciones instrumentadas.",
+            "# TYPE lab6_operacion_segundos histogram",
+        ]
+        with self._lock:
+            for op, hist in sorted(self.histogramas.items()):
+                for limite, acumulado in zip(METRICAS_BUCKETS + ('+Inf',), hist.acumulados()):
+                    lineas.append(f'lab6_operacion_segundos_bucket{{operacion="{op}",le="{limite}"}} {acumulado}')
+                lineas.append(f'lab6_operacion_segundos_sum{{operacion="{op}"}} {hist.suma}')
+                lineas.append(f'lab6_operacion_segundos_count{{operacion="{op}"}} {hist.total}')
+            for nombre, ayuda, tipo, valores in (
+                    ('lab6_operacion_llamadas_total', "Llamadas por operación.", 'counter', self.llamadas),
+                    ('lab6_operacion_errores_total', "Errores por operación.", 'counter', self.errores),
+                    ('lab6_operacion_en_vuelo', "Operaciones en curso.", 'gauge', self.en_vuelo)):
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for op, valor in sorted(valores.items()):
+                    lineas.append(f'{nombre}{{operacion="{op}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+
+metricas = Metricas()
+
+
+def instrumentado(operacion: str, fallido=None):
+    """
+    Decorador: envuelve la función en un span de `metricas`. `fallido(resultado)`
+    marca como error los resultados que no son excepciones (p. ej. push_flow → False).
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with metricas.medir(operacion):
+                resultado = funcion(*args, **kwargs)
+            if fallido is not None and fallido(resultado):
+                metricas.error(operacion)
+            return resultado
+        return envoltura
+    return decorador
+
+
+class ClienteFloodlight:
+    """
+    Cliente REST de Floodlight con una sesión keep-alive compartida.
+
+    Todas las llamadas reutilizan las conexiones TCP del pool, tienen timeout y
+    se reintentan con backoff exponencial ante errores de conexión o 502/503/504.
+    El staticflowpusher identifica los flows por nombre, así que reintentar un
+    POST o DELETE es idempotente.
+    """
+    def __init__(self, base_url: str = BASE_URL, timeout=HTTP_TIMEOUT, reintentos: int = HTTP_REINTENTOS,
+                 backoff: float = HTTP_BACKOFF, pool: int = HTTP_POOL):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        retry = Retry(total=reintentos, backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'POST', 'DELETE'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, ruta: str):
+        return self.session.get(f"{self.base_url}{ruta}", timeout=self.timeout)
+
+    def post(self, ruta: str, data):
+        return self.session.post(f"{self.base_url}{ruta}", json=data, timeout=self.timeout)
+
+    def delete(self, ruta: str, data):
+        return self.session.delete(f"{self.base_url}{ruta}", json=data, timeout=self.timeout)
+
+    def cerrar(self):
+        self.session.close()
+
+
+class TareaFlow:
+    """Instalación o eliminación pendiente de un flow, con los futuros de quienes la pidieron."""
+    __slots__ = ('prioridad', 'secuencia', 'tipo', 'nombre', 'flow', 'futuros', 'encolada', 'cancelada')
+
+    def __init__(self, prioridad: int, secuencia: int, tipo: str, nombre: str, flow: Optional[dict]):
+        self.prioridad = prioridad
+        self.secuencia = secuencia
+        self.tipo = tipo            # 'push' o 'delete'
+        self.nombre = nombre
+        self.flow = flow
+        self.futuros: List[Future] = []
+        self.encolada = time.monotonic()
+        self.cancelada = False
+
+    def __lt__(self, otra):
+        return (self.prioridad, self.secuencia) < (otra.prioridad, otra.secuencia)
+
+
+class PlanificadorFlows:
+    """
+    Cola de operaciones de flows hacia un controlador.
+
+    - Heap por prioridad: eliminaciones y revocaciones salen antes que las
+      altas, y las altas individuales antes que las del lote.
+    - Token bucket de `tasa` peticiones/s (ráfaga `rafaga`) y como máximo
+      `en_vuelo` peticiones simultáneas (un hilo trabajador por petición).
+    - Coalescencia por nombre de flow mientras la operación sigue en cola:
+      dos altas se funden en una (gana el último flow), un alta seguida de
+      una eliminación descarta el alta, y una eliminación seguida de un alta
+      se reduce al alta (el POST reemplaza el flow por nombre).
+    - Contrapresión: con `max_cola` operaciones pendientes, encolar bloquea
+      hasta que los trabajadores liberen espacio.
+    """
+    def __init__(self, cliente: Optional[ClienteFloodlight] = None, tasa: float = FLOWS_POR_SEGUNDO,
+                 rafaga: int = FLOWS_RAFAGA, en_vuelo: int = MAX_WORKERS_LOTE, max_cola: int = FLOWS_MAX_COLA):
+        self.cliente = cliente  # None: se enruta por DPID en push_flow/delete_flow
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.en_vuelo = en_vuelo
+        self.max_cola = max_cola
+        self._heap: List[TareaFlow] = []
+        self._pendientes: Dict[str, TareaFlow] = {}   # nombre -> tarea aún en cola
+        self._secuencia = itertools.count()
+        self._cond = threading.Condition()
+        self._tokens = float(rafaga)
+        self._recarga = time.monotonic()
+        self._lock_tokens = threading.Lock()
+        self._trabajadores: List[threading.Thread] = []
+        self._detenido = False
+        self.activas = 0
+        self.completadas = 0
+        self.fallidas = 0
+        self.fusionadas = 0
+        self.canceladas = 0
+        self.esperas_contrapresion = 0
+        self.espera_total = 0.0
+        self._recientes = collections.deque(maxlen=10000)  # instantes de las últimas operaciones
+
+    def _iniciar_trabajadores(self):
+        while len(self._trabajadores) < self.en_vuelo:
+            hilo = threading.Thread(target=self._trabajar, daemon=True)
+            self._trabajadores.append(hilo)
+            hilo.start()
+
+    def _resolver(self, tarea: TareaFlow, resultado: bool):
+        for futuro in tarea.futuros:
+            futuro.set_result(resultado)
+
+    def encolar(self, tipo: str, nombre: str, flow: Optional[dict] = None, prioridad: int = PRIORIDAD_CREAR) -> Future:
+        """Encola un 'push' o 'delete' y devuelve un Future con el resultado (bool)."""
+        futuro = Future()
+        resueltas = []
+        with self._cond:
+            previa = self._pendientes.get(nombre)
+            if previa is not None and previa.tipo == tipo:
+                # Misma operación ya en cola: se comparte (con el flow más reciente)
+                if flow is not None:
+                    previa.flow = flow
+                if prioridad < previa.prioridad:
+                    # Subir de prioridad: reencolar una copia y anular la anterior
+                    nueva = TareaFlow(prioridad, next(self._secuencia), tipo, nombre, previa.flow)
+                    nueva.futuros, previa.futuros, previa.cancelada = previa.futuros, [], True
+                    self._pendientes[nombre] = nueva
+                    heapq.heappush(self._heap, nueva)
+                    previa = nueva
+                previa.futuros.append(futuro)
+                self.fusionadas += 1
+                return futuro
+            if previa is not None:
+                # Operación opuesta en cola: la nueva la reemplaza
+                previa.cancelada = True
+                del self._pendientes[nombre]
+                self.canceladas += 1
+                # Un alta descartada no llegó a instalarse; una eliminación reemplazada por un alta sí "se cumple"
+                resueltas.append((previa, previa.tipo == 'delete'))
+            else:
+                while len(self._pendientes) >= self.max_cola:
+                    self.esperas_contrapresion += 1
+                    self._cond.wait()
+            tarea = TareaFlow(prioridad, next(self._secuencia), tipo, nombre, flow)
+            tarea.futuros.append(futuro)
+            self._pendientes[nombre] = tarea
+            heapq.heappush(self._heap, tarea)
+            self._iniciar_trabajadores()
+            self._cond.notify()
+        for previa, resultado in resueltas:
+            self._resolver(previa, resultado)
+        return futuro
+
+    def _tomar_token(self):
+        """Token bucket: espera hasta que haya un token disponible."""
+        while True:
+            with self._lock_tokens:
+                ahora = time.monotonic()
+                self._tokens = min(self.rafaga, self._tokens + (ahora - self._recarga) * self.tasa)
+                self._recarga = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+    def _trabajar(self):
+        while True:
+            with self._cond:
+                while True:
+                    while not self._heap and not self._detenido:
+                        self._cond.wait()
+                    if not self._heap:
+                        return
+                    tarea = heapq.heappop(self._heap)
+                    if not tarea.cancelada:
+                        break
+                del self._pendientes[tarea.nombre]
+                self.activas += 1
+                self.espera_total += time.monotonic() - tarea.encolada
+                self._cond.notify_all()  # hay espacio en la cola
+            if self.tasa > 0:
+                self._tomar_token()
+            try:
+                if tarea.tipo == 'push':
+                    ok = push_flow(tarea.flow, silencioso=True, cliente=self.cliente)
+                else:
+                    ok = delete_flow(tarea.nombre, silencioso=True, cliente=self.cliente)
+            except Exception:
+                ok = False
+            with self._cond:
+                self.activas -= 1
+                self.completadas += 1
+                if not ok:
+                    self.fallidas += 1
+                self._recientes.append(time.monotonic())
+            self._resolver(tarea, ok)
+
+    def instalar(self, flows, prioridad: int = PRIORIDAD_CREAR) -> List[bool]:
+        futuros = [self.encolar('push', flow['name'], flow, prioridad) for flow in flows]
+        return [f.result() for f in futuros]
+
+    def eliminar(self, nombres, prioridad: int = PRIORIDAD_ELIMINAR) -> List[bool]:
+        futuros = [self.encolar('delete', nombre, None, prioridad) for nombre in nombres]
+        return [f.result() for f in futuros]
+
+    def detener(self):
+        """Termina los trabajadores después de vaciar la cola."""
+        with self._cond:
+            self._detenido = True
+            self._cond.notify_all()
+        for hilo in self._trabajadores:
+            hilo.join()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._cond:
+            ahora = time.monotonic()
+            ultimos = sum(1 for t in self._recientes if ahora - t <= 10)
+            return {
+                'en_cola': len(self._pendientes),
+                'en_vuelo': self.activas,
+                'completadas': self.completadas,
+                'fallidas': self.fallidas,
+                'fusionadas': self.fusionadas,
+                'canceladas': self.canceladas,
+                'esperas_contrapresion': self.esperas_contrapresion,
+                'espera_promedio_ms': self.espera_total / self.completadas * 1000 if self.completadas else 0.0,
+                'por_segundo': ultimos / 10,
+            }
+
+
+
+class Controlador:
+    """Un Floodlight con sus switches, su pool de conexiones y su cola de flows."""
+    def __init__(self, nombre: str, url: str, dpids: Iterable[str] = ()):
+        self.nombre = nombre
+        self.url = url.rstrip('/')
+        self.dpids = frozenset(d.lower() for d in dpids)
+        self.cliente = ClienteFloodlight(self.url)
+        self.planificador = PlanificadorFlows(self.cliente)
+
+    def cerrar(self):
+        self.planificador.detener()
+        self.cliente.cerrar()
+
+
+class RegistroControladores:
+    """
+    Controladores Floodlight y el DPID -> controlador de cada switch.
+
+    Los flows van al controlador dueño del switch (`flow['switch']`); los
+    DPIDs que no figuran en ningún controlador van al predeterminado. Las
+    consultas globales (dispositivos, enlaces, listado de flows) se hacen a
+    todos en paralelo y se combinan.
+    """
+    def __init__(self):
+        self.controladores: List[Controlador] = []
+        self.por_dpid: Dict[str, Controlador] = {}
+        self.predeterminado: Optional[Controlador] = None
+        self._pool = ThreadPoolExecutor(max_workers=MAX_WORKERS_LOTE)
+
+    def configurar(self, definiciones: List[dict]):
+        """
+        Reemplaza los controladores. Cada definición: {'nombre', 'url',
+        'dpids': [...], 'predeterminado': bool}; sin predeterminado explícito
+        lo es el primero.
+        """
+        if not definiciones:
+            raise ValueError("se necesita al menos un controlador")
+        nombres, duenos = [], {}
+        for i, d in enumerate(definiciones):
+            nombre = str(d.get('nombre') or f"controlador{i + 1}")
+            if not d.get('url'):
+                raise ValueError(f"controlador {nombre} sin 'url'")
+            for dpid in d.get('dpids') or ():
+                if dpid.lower() in duenos:
+                    raise ValueError(f"el DPID {dpid} está en {duenos[dpid.lower()]} y en {nombre}")
+                duenos[dpid.lower()] = nombre
+            nombres.append(nombre)
+        nuevos, predeterminado, por_dpid = [], None, {}
+        for nombre, d in zip(nombres, definiciones):
+            controlador = Controlador(nombre, d['url'], d.get('dpids') or ())
+            nuevos.append(controlador)
+            por_dpid.update(dict.fromkeys(controlador.dpids, controlador))
+            if d.get('predeterminado'):
+                predeterminado = controlador
+        anteriores = self.controladores
+        self.controladores, self.por_dpid = nuevos, por_dpid
+        self.predeterminado = predeterminado or nuevos[0]
+        for controlador in anteriores:
+            controlador.cerrar()
+
+    def para_dpid(self, dpid: Optional[str]) -> Controlador:
+        return self.por_dpid.get((dpid or "").lower(), self.predeterminado)
+
+    def consultar_todos(self, ruta: str) -> List[Tuple[Controlador, Any]]:
+        """GET `ruta` en todos los controladores a la vez: (controlador, respuesta o excepción)."""
+        def consultar(controlador):
+            try:
+                return controlador.cliente.get(ruta)
+            except Exception as e:
+                return e
+        return list(zip(self.controladores, self._pool.map(consultar, self.controladores)))
+
+    def estadisticas_colas(self) -> Dict[str, Dict[str, Any]]:
+        return {c.nombre: c.planificador.estadisticas() for c in self.controladores}
+
+    def exportar_prometheus(self) -> str:
+        stats = self.estadisticas_colas()
+        lineas = []
+        for clave, tipo in (('en_cola', 'gauge'), ('en_vuelo', 'gauge'), ('completadas', 'counter'),
+                            ('fallidas', 'counter'), ('fusionadas', 'counter'), ('canceladas', 'counter'),
+                            ('esperas_contrapresion', 'counter'), ('por_segundo', 'gauge')):
+            nombre = f"lab6_cola_flows_{clave}" + ("_total" if tipo == 'counter' else "")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for controlador, valores in stats.items():
+                lineas.append(f'{nombre}{{controlador="{controlador}"}} {valores[clave]}')
+        return "\n".join(lineas) + "\n"
+
+
+controladores = RegistroControladores()
+controladores.configurar([{'nombre': 'principal', 'url': BASE_URL}])
+
+
+def configurar_controlador(url: str):
+    """Usa un único controlador Floodlight para todos los switches."""
+    global BASE_URL
+    BASE_URL = url.rstrip('/')
+    controladores.configurar([{'nombre': 'principal', 'url': BASE_URL}])
+    cache_dispositivos.invalidar()
+    topologia.invalidar()
+
+
+def cargar_controladores(archivo: str):
+    """
+    Carga los controladores desde un YAML/JSON:
+
+        controladores:
+          - nombre: core
+            url: http://10.0.0.1:8080
+            dpids: ["00:00:00:00:00:00:00:01", ...]
+            predeterminado: true
+    """
+    with open(archivo) as f:
+        data = yaml.load(f, Loader=YamlLoader) or {}
+    definiciones = data.get('controladores') if isinstance(data, dict) else data
+    if not isinstance(definiciones, list):
+        raise ValueError(f"{archivo}: se esperaba una lista 'controladores'")
+    controladores.configurar(definiciones)
+    cache_dispositivos.invalidar()
+    topologia.invalidar()
+
+
+def push_flows_concurrente(flows, prioridad: int = PRIORIDAD_CREAR) -> List[bool]:
+    """
+    Instala varios flows, cada uno en la cola del controlador dueño de su
+    switch; las colas de los distintos controladores avanzan en paralelo.
+    """
+    futuros = [controladores.para_dpid(flow.get('switch')).planificador.encolar('push', flow['name'], flow, prioridad)
+               for flow in flows]
+    return [f.result() for f in futuros]
+
+
+def delete_flows_concurrente(nombres, prioridad: int = PRIORIDAD_ELIMINAR,
+                             switches: Optional[Dict[str, str]] = None) -> List[bool]:
+    """
+    Elimina varios flows (antes que las altas en cola). `switches` da el DPID
+    de cada nombre para enviarlo solo a su controlador; sin él, el DELETE va
+    a todos los controladores (borrar un nombre inexistente no es error).
+    """
+    switches = switches or {}
+    futuros = []
+    for nombre in nombres:
+        dpid = switches.get(nombre)
+        destinos = [controladores.para_dpid(dpid)] if dpid else controladores.controladores
+        futuros.append([c.planificador.encolar('delete', nombre, None, prioridad) for c in destinos])
+    return [all(f.result() for f in grupo) for grupo in futuros]
+
+
+def switches_de(flows) -> Dict[str, str]:
+    """{nombre: dpid} de los flows, para enrutar sus DELETE."""
+    return {flow['name']: flow.get('switch') for flow in flows}
+
 class Alumno:
     """Clase para representar un alumno"""
+    __slots__ = ('nombre', 'codigo', 'mac')
+
     def __init__(self, nombre: str, codigo: int, mac: str):
         self.nombre = nombre
         self.codigo = codigo
@@ -34,9 +640,11 @@ class Alumno:
 
 
 class Servicio:
+    __slots__ = ('nombre', 'protocolo', 'puerto')
+
     def __init__(self, nombre: str, protocolo: str, puerto: int):
-        self.nombre = nombre
-        self.protocolo = protocolo
+        self.nombre = sys.intern(nombre)
+        self.protocolo = sys.intern(protocolo)
         self.puerto = puerto
 
     def to_dict(self):
@@ -50,10 +658,77 @@ class Servicio:
     def from_dict(cls, data):
         return cls(data['nombre'], data['protocolo'], data['puerto'])
 
+
+# Protocolo de Servicio.protocolo -> (ip_proto, prefijo de los campos de puerto)
+PROTOCOLOS_IP = {'TCP': ('0x06', 'tcp'), 'UDP': ('0x11', 'udp')}
+
+
+def rangos_puertos(spec) -> List[Tuple[int, int]]:
+    """
+    Interpreta el puerto de un servicio: 22, "8000-8010", "80,443" o una
+    lista de esos. Devuelve rangos (inicio, fin) ordenados y fusionados.
+    """
+    partes = spec if isinstance(spec, (list, tuple)) else str(spec).split(',')
+    rangos = []
+    for parte in partes:
+        if isinstance(parte, int):
+            inicio = fin = parte
+        else:
+            texto = str(parte).strip()
+            inicio, _, fin = texto.partition('-')
+            inicio, fin = int(inicio), int(fin or inicio)
+        if not 0 < inicio <= fin <= 65535:
+            raise ValueError(f"rango de puertos inválido: {parte}")
+        rangos.append((inicio, fin))
+    fusionados = []
+    for inicio, fin in sorted(rangos):
+        if fusionados and inicio <= fusionados[-1][1] + 1:
+            fusionados[-1] = (fusionados[-1][0], max(fin, fusionados[-1][1]))
+        else:
+            fusionados.append((inicio, fin))
+    return fusionados
+
+
+def prefijos_puertos(inicio: int, fin: int) -> List[Tuple[int, int]]:
+    """Cubre [inicio, fin] con el mínimo de pares (valor, máscara) de 16 bits."""
+    prefijos = []
+    while inicio <= fin:
+        # El bloque alineado más grande que empieza en `inicio` y no se pasa de `fin`
+        tamano = inicio & -inicio if inicio else 1 << 16
+        while inicio + tamano - 1 > fin:
+            tamano >>= 1
+        prefijos.append((inicio, 0xffff & ~(tamano - 1)))
+        inicio += tamano
+    return prefijos
+
+
+class EspecServicio:
+    """
+    Servicio resuelto para armar flows: ip_proto, campo de puerto (tcp/udp)
+    y los puertos como prefijos enmascarados, un flow por prefijo.
+    """
+    __slots__ = ('protocolo', 'ip_proto', 'campo', 'prefijos')
+
+    def __init__(self, servicio: Servicio):
+        protocolo = servicio.protocolo.upper()
+        if protocolo not in PROTOCOLOS_IP:
+            raise ValueError(f"protocolo no soportado: {servicio.protocolo}")
+        self.protocolo = protocolo
+        self.ip_proto, self.campo = PROTOCOLOS_IP[protocolo]
+        self.prefijos = tuple(p for inicio, fin in rangos_puertos(servicio.puerto)
+                              for p in prefijos_puertos(inicio, fin))
+
+    @staticmethod
+    def valor_match(valor: int, mascara: int):
+        """Puerto exacto como entero; prefijo como "0xVVVV/0xMMMM"."""
+        return valor if mascara == 0xffff else f"0x{valor:04x}/0x{mascara:04x}"
+
 class Servidor:
+    __slots__ = ('nombre', 'ip', 'servicios')
+
     def __init__(self, nombre: str, ip: str, servicios: List[Servicio]):
-        self.nombre = nombre
-        self.ip = ip
+        self.nombre = sys.intern(nombre)
+        self.ip = sys.intern(ip)
         self.servicios = servicios
 
     def to_dict(self):
@@ -69,132 +744,848 @@ class Servidor:
         return cls(data['nombre'], data['ip'], servicios)
     
 
+class PermisoServidor:
+    """
+    Servidor habilitado en un curso y los servicios permitidos en él.
+    `clave` y `servicios` ya vienen en minúsculas e internados para comparar
+    sin volver a normalizar en cada consulta.
+    """
+    __slots__ = ('nombre', 'clave', 'servicios_permitidos', 'servicios')
+
+    def __init__(self, nombre: str, servicios_permitidos: List[str]):
+        self.nombre = sys.intern(nombre)
+        self.clave = sys.intern(nombre.lower())
+        self.servicios_permitidos = tuple(sys.intern(srv) for srv in servicios_permitidos)
+        self.servicios = frozenset(sys.intern(srv.lower()) for srv in servicios_permitidos)
+
+    def to_dict(self):
+        return {
+            'nombre': self.nombre,
+            'servicios_permitidos': list(self.servicios_permitidos)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['nombre'], data.get('servicios_permitidos') or [])
+
+
 class Curso:
-    def __init__(self, codigo: str, estado: str, nombre: str, alumnos: List[str], servidores: List[dict]):
-        self.codigo = codigo
-        self.estado = estado
+    __slots__ = ('codigo', 'estado', 'nombre', 'alumnos', 'servidores')
+
+    def __init__(self, codigo: str, estado: str, nombre: str, alumnos: Iterable[int], servidores: List[Any]):
+        self.codigo = sys.intern(codigo)
+        self.estado = sys.intern(estado)
         self.nombre = nombre
-        self.alumnos = alumnos
-        self.servidores = servidores  # lista de dicts
+        # dict ordenado como conjunto: pertenencia O(1) conservando el orden del YAML
+        self.alumnos: Dict[int, None] = dict.fromkeys(alumnos)
+        self.servidores: List[PermisoServidor] = [
+            s if isinstance(s, PermisoServidor) else PermisoServidor.from_dict(s) for s in servidores
+        ]
+
+    def matricular(self, cod_alumno: int):
+        self.alumnos[cod_alumno] = None
+
+    def retirar(self, cod_alumno: int):
+        del self.alumnos[cod_alumno]
 
     def to_dict(self):
         return {
             'codigo': self.codigo,
             'estado': self.estado,
             'nombre': self.nombre,
-            'alumnos': self.alumnos,
-            'servidores': self.servidores
+            'alumnos': list(self.alumnos),
+            'servidores': [s.to_dict() for s in self.servidores]
         }
 
     @classmethod
     def from_dict(cls, data):
-        return cls(data['codigo'], data['estado'], data['nombre'], data.get('alumnos', []), data.get('servidores', []))
+        return cls(data['codigo'], data['estado'], data['nombre'], data.get('alumnos') or [], data.get('servidores') or [])
 
 
-def importar_yaml(nombre_archivo):
-    global alumnos, cursos, servidores
-    with open(nombre_archivo, 'r') as f:
-        data = yaml.safe_load(f)
+class RegistroAcademico:
+    """
+    Alumnos, cursos y servidores con índices hash por clave primaria.
 
-    alumnos = [Alumno.from_dict(a) for a in data.get('alumnos', [])]
-    cursos = [Curso.from_dict(c) for c in data.get('cursos', [])]
-    servidores = [Servidor.from_dict(s) for s in data.get('servidores', [])]
+    Mantiene además el índice por MAC y el índice inverso alumno -> cursos,
+    de modo que búsquedas y borrados en cascada son O(1) u O(k) en vez de
+    recorrer las listas completas.
+    """
+    def __init__(self):
+        self.alumnos: Dict[int, Alumno] = {}
+        self.cursos: Dict[str, Curso] = {}
+        self.servidores: Dict[str, Servidor] = {}   # clave: nombre en minúsculas
+        self.por_mac: Dict[str, Alumno] = {}        # clave: MAC en minúsculas
+        self.cursos_de_alumno: Dict[int, set] = {}
+        # (servidor, servicio) en minúsculas -> EspecServicio
+        self.servicios: Dict[Tuple[str, str], EspecServicio] = {}
+
+    def cargar(self, alumnos: Iterable[Alumno], cursos: Iterable[Curso], servidores: Iterable[Servidor]):
+        for indice in (self.alumnos, self.cursos, self.servidores, self.por_mac, self.cursos_de_alumno,
+                       self.servicios):
+            indice.clear()
+        for a in alumnos:
+            self.agregar_alumno(a)
+        for c in cursos:
+            self.agregar_curso(c)
+        for s in servidores:
+            self.agregar_servidor(s)
+
+    # --- consultas ---
+    def alumno(self, codigo) -> Optional[Alumno]:
+        return self.alumnos.get(codigo)
+
+    def alumno_por_mac(self, mac: str) -> Optional[Alumno]:
+        return self.por_mac.get(mac.lower())
+
+    def curso(self, codigo: str) -> Optional[Curso]:
+        return self.cursos.get(codigo)
+
+    def servidor(self, nombre: str) -> Optional[Servidor]:
+        return self.servidores.get(nombre.lower())
+
+    def servicio(self, nombre_servidor: str, nombre_servicio: str) -> Optional[EspecServicio]:
+        return self.servicios.get((nombre_servidor.lower(), nombre_servicio.lower()))
+
+    def cursos_alumno(self, codigo) -> List[Curso]:
+        return [self.cursos[c] for c in self.cursos_de_alumno.get(codigo, ())]
+
+    # --- altas, cambios y bajas ---
+    def agregar_alumno(self, alumno: Alumno):
+        self.alumnos[alumno.codigo] = alumno
+        self.por_mac[alumno.mac.lower()] = alumno
+
+    def actualizar_mac(self, alumno: Alumno, mac: str):
+        if self.por_mac.get(alumno.mac.lower()) is alumno:
+            del self.por_mac[alumno.mac.lower()]
+        alumno.mac = mac
+        self.por_mac[mac.lower()] = alumno
+
+    def eliminar_alumno(self, codigo) -> List[Curso]:
+        """Borra al alumno y lo retira de sus cursos. Devuelve los cursos afectados."""
+        alumno = self.alumnos.pop(codigo, None)
+        if alumno is None:
+            return []
+        if self.por_mac.get(alumno.mac.lower()) is alumno:
+            del self.por_mac[alumno.mac.lower()]
+        afectados = [self.cursos[c] for c in self.cursos_de_alumno.pop(codigo, ())]
+        for curso in afectados:
+            curso.retirar(codigo)
+        return afectados
+
+    def agregar_curso(self, curso: Curso):
+        self.cursos[curso.codigo] = curso
+        for cod in curso.alumnos:
+            self.cursos_de_alumno.setdefault(cod, set()).add(curso.codigo)
+
+    def matricular(self, curso: Curso, cod_alumno):
+        curso.matricular(cod_alumno)
+        self.cursos_de_alumno.setdefault(cod_alumno, set()).add(curso.codigo)
+
+    def retirar(self, curso: Curso, cod_alumno):
+        curso.retirar(cod_alumno)
+        codigos = self.cursos_de_alumno.get(cod_alumno)
+        if codigos:
+            codigos.discard(curso.codigo)
+            if not codigos:
+                del self.cursos_de_alumno[cod_alumno]
+
+    def agregar_servidor(self, servidor: Servidor):
+        self.servidores[servidor.nombre.lower()] = servidor
+        self.indexar_servicios(servidor)
+
+    def indexar_servicios(self, servidor: Servidor):
+        """(Re)calcula las entradas de la tabla de servicios de un servidor."""
+        clave = servidor.nombre.lower()
+        for k in [k for k in self.servicios if k[0] == clave]:
+            del self.servicios[k]
+        for srv in servidor.servicios:
+            try:
+                self.servicios[(clave, srv.nombre.lower())] = EspecServicio(srv)
+            except ValueError as e:
+                print(f" Servicio {srv.nombre} de {servidor.nombre} ignorado: {e}")
 
-def exportar_yaml(nombre_archivo, alumnos, cursos, servidores):
-    data = {
-        'alumnos': [a.to_dict() for a in alumnos],
-        'cursos': [c.to_dict() for c in cursos],
-        'servidores': [s.to_dict() for s in servidores]
-    }
-    with open(nombre_archivo, 'w') as f:
-        yaml.dump(data, f)
+
+registro = RegistroAcademico()
+
+
+class AlmacenConexiones:
+    """
+    Registro persistente de conexiones activas en SQLite (modo WAL).
+
+    Sobrevive a reinicios del programa, así que los handlers de los flows que
+    siguen instalados en los switches no se pierden. Cada alta o baja es una
+    transacción de O(1) filas; las búsquedas por handler, alumno, servidor o
+    nombre de flow usan índices. Nada se carga al iniciar: la base se abre en
+    el primer acceso y cada consulta lee solo lo que necesita.
+    """
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS conexiones (
+            handler TEXT PRIMARY KEY,
+            alumno INTEGER NOT NULL,
+            servidor TEXT NOT NULL,
+            servidor_clave TEXT NOT NULL,
+            servicio TEXT NOT NULL,
+            creada REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conexiones_alumno ON conexiones(alumno);
+        CREATE INDEX IF NOT EXISTS idx_conexiones_servidor ON conexiones(servidor_clave);
+        CREATE TABLE IF NOT EXISTS flows (
+            handler TEXT NOT NULL REFERENCES conexiones(handler) ON DELETE CASCADE,
+            nombre TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (handler, nombre)
+        );
+        CREATE INDEX IF NOT EXISTS idx_flows_nombre ON flows(nombre);
+    """
+
+    def __init__(self, ruta: str = CONEXIONES_DB):
+        self.ruta = ruta
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    db = sqlite3.connect(self.ruta, check_same_thread=False, isolation_level=None)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute("PRAGMA synchronous=NORMAL")
+                    db.execute("PRAGMA foreign_keys=ON")
+                    db.executescript(self.ESQUEMA)
+                    self._db = db
+        return self._db
+
+    def _consultar(self, sql: str, parametros=()) -> List[tuple]:
+        with self._lock:
+            return self.db.execute(sql, parametros).fetchall()
+
+    def _armar(self, filas) -> List[dict]:
+        """Convierte filas de `conexiones` en dicts con sus flows."""
+        flows: Dict[str, List[dict]] = {}
+        handlers = [fila[0] for fila in filas]
+        # Los flows se traen en bloques con IN (...) en vez de una consulta por conexión
+        for i in range(0, len(handlers), 500):
+            bloque = handlers[i:i + 500]
+            marcas = ",".join("?" * len(bloque))
+            for handler, payload in self._consultar(
+                    f"SELECT handler, payload FROM flows WHERE handler IN ({marcas}) ORDER BY rowid", bloque):
+                flows.setdefault(handler, []).append(json.loads(payload))
+        return [{'handler': handler, 'alumno': alumno, 'servidor': servidor, 'servicio': servicio,
+                 'flows': flows.get(handler, [])}
+                for handler, alumno, servidor, servicio in filas]
+
+    def agregar(self, conexion: dict):
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN")
+            try:
+                db.execute("INSERT OR REPLACE INTO conexiones VALUES (?, ?, ?, ?, ?, ?)",
+                           (conexion['handler'], conexion['alumno'], conexion['servidor'],
+                            conexion['servidor'].lower(), conexion['servicio'], time.time()))
+                self._guardar_flows(conexion)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def _guardar_flows(self, conexion: dict):
+        self.db.execute("DELETE FROM flows WHERE handler = ?", (conexion['handler'],))
+        self.db.executemany("INSERT INTO flows VALUES (?, ?, ?)",
+                            [(conexion['handler'], f['name'], json.dumps(f)) for f in conexion.get('flows', [])])
+
+    def actualizar(self, conexion: dict):
+        with self._lock:
+            db = self.db
+            db.execute("BEGIN")
+            try:
+                self._guardar_flows(conexion)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def eliminar(self, handler: str) -> Optional[dict]:
+        with self._lock:
+            conexion = self.obtener(handler)
+            if conexion is not None:
+                self.db.execute("DELETE FROM conexiones WHERE handler = ?", (handler,))
+            return conexion
+
+    def obtener(self, handler: str) -> Optional[dict]:
+        filas = self._consultar("SELECT handler, alumno, servidor, servicio FROM conexiones WHERE handler = ?",
+                                (handler,))
+        return self._armar(filas)[0] if filas else None
+
+    def handlers_de_alumno(self, cod_alumno) -> List[str]:
+        return [h for (h,) in self._consultar("SELECT handler FROM conexiones WHERE alumno = ?", (cod_alumno,))]
+
+    def de_alumno(self, cod_alumno) -> List[dict]:
+        return self._armar(self._consultar(
+            "SELECT handler, alumno, servidor, servicio FROM conexiones WHERE alumno = ?", (cod_alumno,)))
+
+    def de_servidor(self, nombre_servidor: str) -> List[dict]:
+        return self._armar(self._consultar(
+            "SELECT handler, alumno, servidor, servicio FROM conexiones WHERE servidor_clave = ?",
+            (nombre_servidor.lower(),)))
+
+    def referenciados_por_otros(self, nombres: Iterable[str], handlers: Iterable[str]) -> set:
+        """Nombres de flows que usa al menos una conexión fuera de `handlers` (conteo de referencias)."""
+        nombres, handlers = list(set(nombres)), set(handlers)
+        referenciados = set()
+        for i in range(0, len(nombres), 500):
+            bloque = nombres[i:i + 500]
+            marcas = ",".join("?" * len(bloque))
+            for nombre, handler in self._consultar(
+                    f"SELECT nombre, handler FROM flows WHERE nombre IN ({marcas})", bloque):
+                if handler not in handlers:
+                    referenciados.add(nombre)
+        return referenciados
+
+    def conteo_flows(self) -> Tuple[int, int, int]:
+        """(referencias totales, flows distintos instalados, conexiones sin flows registrados)."""
+        referencias, distintos = self._consultar("SELECT COUNT(*), COUNT(DISTINCT nombre) FROM flows")[0]
+        sin_flows = self._consultar(
+            "SELECT COUNT(*) FROM conexiones WHERE handler NOT IN (SELECT DISTINCT handler FROM flows)")[0][0]
+        return referencias, distintos, sin_flows
+
+    def de_curso(self, curso) -> List[dict]:
+        servidores_curso = {s.clave for s in curso.servidores}
+        return [c for cod in curso.alumnos for c in self.de_alumno(cod)
+                if c['servidor'].lower() in servidores_curso]
+
+    def recorrer(self, bloque: int = 1000) -> Iterable[dict]:
+        """
+        Recorre las conexiones sin sus flows, `bloque` filas por consulta
+        (paginando por handler), sin cargar la tabla entera en memoria. El
+        lock solo se toma durante cada consulta.
+        """
+        ultimo = ""
+        while True:
+            filas = self._consultar("SELECT handler, alumno, servidor, servicio FROM conexiones "
+                                    "WHERE handler > ? ORDER BY handler LIMIT ?", (ultimo, bloque))
+            for handler, alumno, servidor, servicio in filas:
+                yield {'handler': handler, 'alumno': alumno, 'servidor': servidor, 'servicio': servicio}
+            if len(filas) < bloque:
+                return
+            ultimo = filas[-1][0]
+
+    def cerrar(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __iter__(self):
+        return iter(self._armar(self._consultar(
+            "SELECT handler, alumno, servidor, servicio FROM conexiones ORDER BY creada")))
+
+    def __len__(self):
+        return self._consultar("SELECT COUNT(*) FROM conexiones")[0][0]
+
+
+conexiones = AlmacenConexiones()
+
+
+class IndicePoliticas:
+    """
+    Índice precompilado de políticas de acceso.
+
+    Mapea (servidor, servicio) -> {codigo_alumno: n_cursos} para responder en O(1)
+    si un alumno puede usar un servicio. Se cuenta cuántos cursos DICTANDO otorgan
+    el permiso para poder retirar un alumno de un curso sin perder el acceso que
+    le dan los demás.
+    """
+    def __init__(self):
+        self.permisos: Dict[tuple, Dict[int, int]] = {}
+
+    @staticmethod
+    def _claves_curso(curso):
+        for s in curso.servidores:
+            for srv in s.servicios:
+                yield (s.clave, srv)
+
+    def reconstruir(self, cursos):
+        self.permisos = {}
+        for curso in cursos:
+            self.agregar_curso(curso)
+
+    def agregar_curso(self, curso):
+        for cod in curso.alumnos:
+            self.agregar_alumno(curso, cod)
+
+    def quitar_curso(self, curso):
+        for cod in curso.alumnos:
+            self.quitar_alumno(curso, cod)
+
+    def agregar_alumno(self, curso, cod_alumno):
+        if curso.estado != "DICTANDO":
+            return
+        for clave in self._claves_curso(curso):
+            alumnos_clave = self.permisos.setdefault(clave, {})
+            alumnos_clave[cod_alumno] = alumnos_clave.get(cod_alumno, 0) + 1
+
+    def quitar_alumno(self, curso, cod_alumno):
+        if curso.estado != "DICTANDO":
+            return
+        for clave in self._claves_curso(curso):
+            alumnos_clave = self.permisos.get(clave)
+            if not alumnos_clave or cod_alumno not in alumnos_clave:
+                continue
+            alumnos_clave[cod_alumno] -= 1
+            if alumnos_clave[cod_alumno] <= 0:
+                del alumnos_clave[cod_alumno]
+            if not alumnos_clave:
+                del self.permisos[clave]
+
+    def permitido(self, cod_alumno, servidor, servicio) -> bool:
+        return cod_alumno in self.permisos.get((servidor.lower(), servicio.lower()), ())
+
+    def consultar_lote(self, tuplas) -> List[bool]:
+        """
+        Evalúa muchas tuplas (alumno, servidor, servicio) en una sola llamada.
+        """
+        permisos = self.permisos
+        resultado = []
+        for cod_alumno, servidor, servicio in tuplas:
+            resultado.append(cod_alumno in permisos.get((servidor.lower(), servicio.lower()), ()))
+        return resultado
+
+
+indice_politicas = IndicePoliticas()
+
+
+def _leer_nodo(loader, anclas):
+    """
+    Compone el siguiente nodo YAML a partir de eventos del parser. Equivale a
+    Composer.compose_node, que el loader en C no expone, y permite construir
+    los elementos de una sección de a uno sin cargar el documento completo.
+    """
+    evento = loader.get_event()
+    if isinstance(evento, yaml.AliasEvent):
+        return anclas[evento.anchor]
+    tag = evento.tag
+    if isinstance(evento, yaml.ScalarEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, evento.value, evento.implicit)
+        nodo = yaml.ScalarNode(tag, evento.value, evento.start_mark, evento.end_mark, style=evento.style)
+    elif isinstance(evento, yaml.SequenceStartEvent):
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, evento.implicit)
+        nodo = yaml.SequenceNode(tag, [], evento.start_mark, None, flow_style=evento.flow_style)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            nodo.value.append(_leer_nodo(loader, anclas))
+        nodo.end_mark = loader.get_event().end_mark
+    else:
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, evento.implicit)
+        nodo = yaml.MappingNode(tag, [], evento.start_mark, None, flow_style=evento.flow_style)
+        while not loader.check_event(yaml.MappingEndEvent):
+            clave = _leer_nodo(loader, anclas)
+            nodo.value.append((clave, _leer_nodo(loader, anclas)))
+        nodo.end_mark = loader.get_event().end_mark
+    if evento.anchor is not None:
+        anclas[evento.anchor] = nodo
+    return nodo
+
+
+def iterar_yaml(nombre_archivo):
+    """
+    Recorre un YAML {seccion: [elementos]} y produce (seccion, elemento) a
+    medida que se leen, sin materializar el documento entero.
+    """
+    with open(nombre_archivo, 'rb') as f:
+        loader = YamlLoader(f)
+        try:
+            loader.get_event()  # StreamStart
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()  # DocumentStart
+            if not loader.check_event(yaml.MappingStartEvent):
+                raise yaml.YAMLError(f"{nombre_archivo}: se esperaba un mapeo en la raíz")
+            loader.get_event()
+            anclas = {}
+            while not loader.check_event(yaml.MappingEndEvent):
+                seccion = loader.construct_document(_leer_nodo(loader, anclas))
+                if loader.check_event(yaml.SequenceStartEvent):
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        yield seccion, loader.construct_document(_leer_nodo(loader, anclas))
+                    loader.get_event()
+                else:
+                    _leer_nodo(loader, anclas)  # sección vacía o desconocida
+        finally:
+            loader.dispose()
+
+
+def _cargar_estado(alumnos, cursos, servidores):
+    registro.cargar(alumnos, cursos, servidores)
+    indice_politicas.reconstruir(registro.cursos.values())
+
+
+def registro_como_listas():
+    return (list(registro.alumnos.values()), list(registro.cursos.values()),
+            list(registro.servidores.values()))
+
+
+def _firma_cache(nombre_archivo) -> dict:
+    cache = nombre_archivo + EXT_SNAPSHOT
+    resumen = hashlib.sha256()
+    with open(cache, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            resumen.update(bloque)
+    base = os.stat(nombre_archivo)
+    return {'tamano': base.st_size, 'mtime_ns': base.st_mtime_ns, 'sha256': resumen.hexdigest()}
+
+
+def firmar_cache_snapshot(nombre_archivo):
+    """
+    Deja junto a <base>.snap el tamaño y mtime del YAML del que se generó y
+    el SHA-256 del snapshot (<base>.snap.firma).
+    """
+    with escritura_atomica(nombre_archivo + EXT_SNAPSHOT + EXT_FIRMA) as f:
+        json.dump(_firma_cache(nombre_archivo), f)
+
+
+def cache_snapshot_valida(nombre_archivo) -> bool:
+    """True si <base>.snap lo escribió esta herramienta a partir del YAML actual."""
+    try:
+        with open(nombre_archivo + EXT_SNAPSHOT + EXT_FIRMA) as f:
+            firma = json.load(f)
+        return firma == _firma_cache(nombre_archivo)
+    except (OSError, ValueError):
+        return False
+
+
+@instrumentado('importar_yaml')
+def importar_yaml(nombre_archivo) -> float:
+    """
+    Importa la base construyendo los objetos sección por sección. Devuelve la
+    duración en segundos. Si la última compactación dejó un snapshot firmado
+    del YAML actual (<base>.snap con su .firma), carga ese snapshot en su
+    lugar; un .snap sin firma válida se ignora y solo se abre importándolo
+    explícitamente.
+    """
+    inicio = time.perf_counter()
+    if cache_snapshot_valida(nombre_archivo):
+        try:
+            importar_snapshot(nombre_archivo + EXT_SNAPSHOT)
+            return time.perf_counter() - inicio
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            pass
+    secciones = {'alumnos': ([], Alumno.from_dict), 'cursos': ([], Curso.from_dict),
+                 'servidores': ([], Servidor.from_dict)}
+    for seccion, elemento in iterar_yaml(nombre_archivo):
+        if seccion in secciones:
+            destino, constructor = secciones[seccion]
+            destino.append(constructor(elemento))
+    _cargar_estado(*(destino for destino, _ in secciones.values()))
+    return time.perf_counter() - inicio
+
+
+@contextlib.contextmanager
+def escritura_atomica(nombre_archivo, modo='w', **opciones):
+    """
+    Escribe en un temporal junto al destino y lo renombra encima al terminar
+    (os.replace), así un corte a mitad de la escritura no deja el archivo a medias.
+    """
+    temporal = f"{nombre_archivo}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporal, modo, **opciones) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, nombre_archivo)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporal)
+        raise
+
+
+@instrumentado('exportar_yaml')
+def exportar_yaml(nombre_archivo, alumnos, cursos, servidores) -> float:
+    """Escribe la base sección por sección, en bloques, con el mismo formato que yaml.dump."""
+    inicio = time.perf_counter()
+    with escritura_atomica(nombre_archivo) as f:
+        for seccion, elementos in (('alumnos', alumnos), ('cursos', cursos), ('servidores', servidores)):
+            elementos = list(elementos)
+            if not elementos:
+                f.write(f"{seccion}: []\n")
+                continue
+            f.write(f"{seccion}:\n")
+            for i in range(0, len(elementos), YAML_BLOQUE_EXPORT):
+                bloque = [e.to_dict() for e in elementos[i:i + YAML_BLOQUE_EXPORT]]
+                yaml.dump(bloque, f, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True)
+    return time.perf_counter() - inicio
+
+
+def exportar_snapshot(nombre_archivo, alumnos, cursos, servidores) -> float:
+    """Guarda la base en un snapshot binario que se carga en milisegundos."""
+    inicio = time.perf_counter()
+    data = {'version': SNAPSHOT_VERSION, 'alumnos': list(alumnos), 'cursos': list(cursos),
+            'servidores': list(servidores)}
+    with escritura_atomica(nombre_archivo, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return time.perf_counter() - inicio
+
+
+def importar_snapshot(nombre_archivo) -> float:
+    """
+    Carga un snapshot generado por exportar_snapshot. Usa pickle: solo deben
+    abrirse snapshots propios, nunca archivos de terceros.
+    """
+    inicio = time.perf_counter()
+    with open(nombre_archivo, 'rb') as f:
+        data = pickle.load(f)
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"{nombre_archivo}: versión de snapshot no soportada")
+    _cargar_estado(data['alumnos'], data['cursos'], data['servidores'])
+    return time.perf_counter() - inicio
+
+
+def aplicar_cambio(cambio: dict):
+    """
+    Aplica una entrada del diario sobre `registro` (sin tocar Floodlight).
+    Cada entrada fija un valor absoluto, así que reaplicar una que ya estaba
+    incluida en la base no cambia el resultado.
+    """
+    op = cambio['op']
+    if op == 'alumno':
+        dato = cambio['dato']
+        alumno = registro.alumno(dato['codigo'])
+        if alumno is None:
+            registro.agregar_alumno(Alumno.from_dict(dato))
+        else:
+            alumno.nombre = dato['nombre']
+            if alumno.mac != dato['mac']:
+                registro.actualizar_mac(alumno, dato['mac'])
+    elif op == 'alumno_baja':
+        registro.eliminar_alumno(cambio['codigo'])
+    elif op == 'servidor':
+        registro.agregar_servidor(Servidor.from_dict(cambio['dato']))
+    else:
+        curso = registro.curso(cambio['curso'])
+        if curso is None:
+            return
+        if op == 'matricula' and cambio['alumno'] not in curso.alumnos:
+            registro.matricular(curso, cambio['alumno'])
+        elif op == 'retiro' and cambio['alumno'] in curso.alumnos:
+            registro.retirar(curso, cambio['alumno'])
+        elif op == 'estado':
+            curso.estado = sys.intern(cambio['estado'])
+
+
+class DiarioCambios:
+    """
+    Diario de cambios de la base vinculada (la última importada o exportada).
+
+    Las operaciones del núcleo anotan cada mutación de alumnos, cursos y
+    servidores. Exportar sobre la base vinculada solo agrega los cambios
+    pendientes a <base>.diario; al pasar DIARIO_MAX_ENTRADAS entradas se
+    compacta en un hilo: se reescribe la base completa (y su <base>.snap)
+    con escritura atómica y se recorta el diario. Importar la base aplica
+    después las entradas del diario.
+    """
+    def __init__(self, max_entradas: int = DIARIO_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self.base: Optional[str] = None
+        self.pendientes: List[dict] = []
+        self.secuencia = 0      # última secuencia escrita en el diario
+        self.entradas = 0       # entradas en el archivo del diario
+        self.compactaciones = 0
+        self._compactador: Optional[threading.Thread] = None
+        self._lock = threading.Lock()  # serializa el acceso al archivo del diario
+
+    @staticmethod
+    def _leer(base: str) -> List[dict]:
+        entradas = []
+        try:
+            with open(base + EXT_DIARIO) as f:
+                for linea in f:
+                    try:
+                        entradas.append(json.loads(linea))
+                    except ValueError:
+                        break  # última línea cortada por una caída: se descarta
+        except FileNotFoundError:
+            pass
+        return entradas
+
+    def vinculado(self, archivo: str) -> bool:
+        return self.base is not None and self.base == os.path.abspath(archivo)
+
+    def vincular(self, archivo: str, descartar: bool = False) -> int:
+        """
+        Vincula el diario a `archivo`. Con descartar=True (la base se acaba de
+        escribir completa) borra el diario y el snapshot de caché anteriores;
+        si no, aplica el diario existente. Devuelve las entradas aplicadas.
+        """
+        self.esperar()
+        self.base = os.path.abspath(archivo)
+        self.pendientes = []
+        if descartar:
+            cache = self.base + EXT_SNAPSHOT
+            for sobrante in (self.base + EXT_DIARIO, cache, cache + EXT_FIRMA):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(sobrante)
+            self.secuencia = self.entradas = 0
+            return 0
+        entradas = self._leer(self.base)
+        for cambio in entradas:
+            aplicar_cambio(cambio)
+        if entradas:
+            indice_politicas.reconstruir(registro.cursos.values())
+        self.secuencia = max((c['seq'] for c in entradas), default=0)
+        self.entradas = len(entradas)
+        return len(entradas)
+
+    def anotar(self, cambio: dict):
+        if self.base is not None:
+            self.pendientes.append(cambio)
+
+    def guardar(self) -> float:
+        """Agrega los cambios pendientes al diario. Devuelve la duración en segundos."""
+        inicio = time.perf_counter()
+        if self.pendientes:
+            with self._lock:
+                with open(self.base + EXT_DIARIO, 'a') as f:
+                    for cambio in self.pendientes:
+                        self.secuencia += 1
+                        f.write(json.dumps(dict(cambio, seq=self.secuencia), ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.entradas += len(self.pendientes)
+            self.pendientes = []
+        if self.entradas >= self.max_entradas and not self.compactando():
+            self.compactar_en_segundo_plano()
+        return time.perf_counter() - inicio
+
+    def compactando(self) -> bool:
+        return self._compactador is not None and self._compactador.is_alive()
+
+    def compactar_en_segundo_plano(self):
+        """
+        Copia el estado (pickle en memoria, rápido) y lo escribe en un hilo.
+        Debe llamarse con `lock_estado` tomado, igual que guardar().
+        """
+        copia = pickle.dumps(registro_como_listas(), protocol=pickle.HIGHEST_PROTOCOL)
+        self._compactador = threading.Thread(target=self._compactar, args=(self.base, copia, self.secuencia),
+                                             daemon=True)
+        self._compactador.start()
+
+    def _compactar(self, base: str, copia: bytes, corte: int):
+        try:
+            alumnos, cursos, servidores = pickle.loads(copia)
+            if base.endswith(EXT_SNAPSHOT):
+                exportar_snapshot(base, alumnos, cursos, servidores)
+            else:
+                exportar_yaml(base, alumnos, cursos, servidores)
+                exportar_snapshot(base + EXT_SNAPSHOT, alumnos, cursos, servidores)
+                firmar_cache_snapshot(base)
+            # Recortar el diario: quedan solo las entradas escritas durante la compactación
+            with self._lock:
+                restantes = [c for c in self._leer(base) if c['seq'] > corte]
+                with escritura_atomica(base + EXT_DIARIO) as f:
+                    for cambio in restantes:
+                        f.write(json.dumps(cambio, ensure_ascii=False) + "\n")
+                if self.base == base:
+                    self.entradas = len(restantes)
+            self.compactaciones += 1
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            print(f" No se pudo compactar {base}: {e}")
+
+    def esperar(self):
+        if self._compactador is not None:
+            self._compactador.join()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'base': self.base,
+            'pendientes': len(self.pendientes),
+            'entradas': self.entradas,
+            'compactaciones': self.compactaciones,
+            'compactando': self.compactando(),
+        }
+
+
+diario = DiarioCambios()
 
 
 #opcion 3 menu cursos
 def menu_cursos():
-    global cursos, alumnos
-
     while True:
         print("\n--- MENÚ CURSOS ---")
         print("1) Listar cursos")
         print("2) Mostrar detalle de un curso")
         print("3) Actualizar curso (agregar/eliminar alumno)")
+        print("4) Cambiar estado de un curso")
         print("0) Volver")
         opcion = input("Seleccione una opción: ").strip()
 
-        if opcion == '1':
-            print("\n--- Lista de cursos ---")
-            for c in cursos:
-                print(f"- {c.codigo}: {c.nombre} [{c.estado}]")
-
-        elif opcion == '2':
-            codigo = input("Ingrese el código del curso: ").strip()
-            curso = next((c for c in cursos if c.codigo == codigo), None)
-            if curso:
-                print(f"\nCurso: {curso.nombre}")
-                print(f"Estado: {curso.estado}")
+        try:
+            if opcion == '1':
+                print("\n--- Lista de cursos ---")
+                for c in listar_cursos():
+                    print(f"- {c['codigo']}: {c['nombre']} [{c['estado']}]")
+
+            elif opcion == '2':
+                codigo = input("Ingrese el código del curso: ").strip()
+                curso = detalle_curso(codigo)
+                print(f"\nCurso: {curso['nombre']}")
+                print(f"Estado: {curso['estado']}")
                 print("Alumnos:")
-                for cod in curso.alumnos:
-                    alumno = next((a for a in alumnos if a.codigo == cod), None)
+                for cod in curso['alumnos']:
+                    alumno = registro.alumno(cod)
                     if alumno:
                         print(f"  - {alumno.nombre} ({alumno.codigo})")
                 print("Servidores:")
-                for s in curso.servidores:
+                for s in curso['servidores']:
                     print(f"  - {s['nombre']}: servicios {', '.join(s['servicios_permitidos'])}")
-            else:
-                print("Curso no encontrado.")
 
-        elif opcion == '3':
-            codigo = input("Ingrese el código del curso a modificar: ").strip()
-            curso = next((c for c in cursos if c.codigo == codigo), None)
-            if not curso:
-                print("Curso no encontrado.")
-                continue
-
-            print("1) Agregar alumno")
-            print("2) Eliminar alumno")
-            accion = input("Seleccione acción: ").strip()
-
-            if accion == '1':
-                cod_alumno_str = input("Código del alumno a agregar: ").strip()
-                try:
-                    cod_alumno = int(cod_alumno_str)
-                except ValueError:
-                    print("El código debe ser un número.")
-                    continue
-
-                if cod_alumno in curso.alumnos:
-                    print("El alumno ya está en el curso.")
-                elif any(a.codigo == cod_alumno for a in alumnos):
-                    curso.alumnos.append(cod_alumno)
+            elif opcion == '3':
+                codigo = input("Ingrese el código del curso a modificar: ").strip()
+                detalle_curso(codigo)
+
+                print("1) Agregar alumno")
+                print("2) Eliminar alumno")
+                accion = input("Seleccione acción: ").strip()
+
+                if accion == '1':
+                    cod_alumno_str = input("Código del alumno a agregar: ").strip()
+                    try:
+                        cod_alumno = int(cod_alumno_str)
+                    except ValueError:
+                        print("El código debe ser un número.")
+                        continue
+                    matricular_alumno(codigo, cod_alumno)
                     print("Alumno agregado.")
-                else:
-                    print("Alumno no registrado en el sistema.")
-            elif accion == '2':
-                cod_alumno_str = input("Código del alumno a eliminar: ").strip()
-                try:
-                    cod_alumno = int(cod_alumno_str)
-                except ValueError:
-                    print("El código debe ser un número.")
-                    continue
-
-                if cod_alumno in curso.alumnos:
-                    curso.alumnos.remove(cod_alumno)
+                elif accion == '2':
+                    cod_alumno_str = input("Código del alumno a eliminar: ").strip()
+                    try:
+                        cod_alumno = int(cod_alumno_str)
+                    except ValueError:
+                        print("El código debe ser un número.")
+                        continue
+                    retirar_alumno(codigo, cod_alumno)
                     print("Alumno eliminado.")
                 else:
-                    print("El alumno no está en este curso.")
+                    print("Opción inválida.")
+
+            elif opcion == '4':
+                codigo = input("Ingrese el código del curso: ").strip()
+                curso = detalle_curso(codigo)
+                estado = input(f"Nuevo estado (actual {curso['estado']}): ")
+                cambiar_estado_curso(codigo, estado)
+                print("Estado actualizado.")
+
+            elif opcion == '0':
+                break
             else:
                 print("Opción inválida.")
-        
-        elif opcion == '0':
-            break
-        else:
-            print("Opción inválida.")
+        except OperacionInvalida as e:
+            print(e)
 
 #opcion 4 menu alumnos
 def menu_alumnos():
-    global alumnos, cursos
-
     while True:
         print("\n--- MENU ALUMNOS ---")
         print("1) Crear")
@@ -206,172 +1597,1436 @@ def menu_alumnos():
 
         opcion = input("Seleccione una opción: ").strip()
 
-        if opcion == '1':
-            print("\n--- Crear nuevo alumno ---")
-            codigo_str = input("Código PUCP: ").strip()
-            try:
-                codigo = int(codigo_str)
-            except ValueError:
-                print("El código debe ser un número.")
-                continue
-            if any(a.codigo == codigo for a in alumnos):
-                print("Ya existe un alumno con ese código.")
-                continue
-            nombre = input("Nombre completo: ").strip()
-            mac = input("Dirección MAC (ej. 44:11:22:44:A7:2A): ").strip()
-            nuevo = Alumno(nombre, codigo, mac)
-            alumnos.append(nuevo)
-            print("Alumno creado exitosamente.")
+        try:
+            if opcion == '1':
+                print("\n--- Crear nuevo alumno ---")
+                codigo_str = input("Código PUCP: ").strip()
+                try:
+                    codigo = int(codigo_str)
+                except ValueError:
+                    print("El código debe ser un número.")
+                    continue
+                if registro.alumno(codigo):
+                    print("Ya existe un alumno con ese código.")
+                    continue
+                nombre = input("Nombre completo: ").strip()
+                mac = input("Dirección MAC (ej. 44:11:22:44:A7:2A): ").strip()
+                crear_alumno(codigo, nombre, mac)
+                print("Alumno creado exitosamente.")
 
-        elif opcion == '2':
-            print("\n--- Lista de alumnos ---")
-            for a in alumnos:
-                print(f"- {a.codigo} | {a.nombre} | {a.mac}")
+            elif opcion == '2':
+                print("\n--- Lista de alumnos ---")
+                for a in listar_alumnos():
+                    print(f"- {a['codigo']} | {a['nombre']} | {a['mac']}")
 
-        elif opcion == '3':
-            try:
-                codigo = int(input("Ingrese el código del alumno: ").strip())
-            except ValueError:
-                print("Código inválido. Debe ser un número.")
-                continue
+            elif opcion == '3':
+                try:
+                    codigo = int(input("Ingrese el código del alumno: ").strip())
+                except ValueError:
+                    print("Código inválido. Debe ser un número.")
+                    continue
 
-            alumno = next((a for a in alumnos if a.codigo == codigo), None)
-            if alumno:
+                alumno = detalle_alumno(codigo)
                 print(f"\nDetalles del alumno:")
-                print(f"- Código : {alumno.codigo}")
-                print(f"- Nombre : {alumno.nombre}")
-                print(f"- MAC    : {alumno.mac}")
-            else:
-                print("Alumno no encontrado.")
+                print(f"- Código : {alumno['codigo']}")
+                print(f"- Nombre : {alumno['nombre']}")
+                print(f"- MAC    : {alumno['mac']}")
 
-        elif opcion == '4':
-            codigo = input("Ingrese el código del alumno a actualizar: ").strip()
-            alumno = next((a for a in alumnos if a.codigo == codigo), None)
-            if alumno:
-                nuevo_nombre = input(f"Nuevo nombre (enter para mantener '{alumno.nombre}'): ").strip()
-                nueva_mac = input(f"Nueva MAC (enter para mantener '{alumno.mac}'): ").strip()
-                if nuevo_nombre:
-                    alumno.nombre = nuevo_nombre
-                if nueva_mac:
-                    alumno.mac = nueva_mac
+            elif opcion == '4':
+                try:
+                    codigo = int(input("Ingrese el código del alumno a actualizar: ").strip())
+                except ValueError:
+                    print("Código inválido. Debe ser un número.")
+                    continue
+                alumno = detalle_alumno(codigo)
+                nuevo_nombre = input(f"Nuevo nombre (enter para mantener '{alumno['nombre']}'): ").strip()
+                nueva_mac = input(f"Nueva MAC (enter para mantener '{alumno['mac']}'): ").strip()
+                actualizar_alumno(codigo, nuevo_nombre, nueva_mac)
                 print("Alumno actualizado.")
-            else:
-                print("Alumno no encontrado.")
 
-        elif opcion == '5':
-            codigo = input("Ingrese el código del alumno a eliminar: ").strip()
-            alumno = next((a for a in alumnos if a.codigo == codigo), None)
-            if alumno:
-                confirm = input(f"¿Está seguro de eliminar al alumno {alumno.nombre}? (s/n): ").lower()
+            elif opcion == '5':
+                try:
+                    codigo = int(input("Ingrese el código del alumno a eliminar: ").strip())
+                except ValueError:
+                    print("Código inválido. Debe ser un número.")
+                    continue
+                alumno = detalle_alumno(codigo)
+                confirm = input(f"¿Está seguro de eliminar al alumno {alumno['nombre']}? (s/n): ").lower()
                 if confirm == 's':
-                    alumnos = [a for a in alumnos if a.codigo != codigo]
-                    # Además, eliminarlo de todos los cursos
-                    for c in cursos:
-                        if codigo in c.alumnos:
-                            c.alumnos.remove(codigo)
+                    eliminar_alumno(codigo)
                     print("Alumno eliminado de la lista y de todos los cursos.")
-            else:
-                print("Alumno no encontrado.")
 
-        elif opcion == '0':
-            break
+            elif opcion == '0':
+                break
 
-        else:
-            print("Opción inválida.")
+            else:
+                print("Opción inválida.")
+        except OperacionInvalida as e:
+            print(e)
 
 
 
 #opcion 5 menu servidores
 def menu_servidores():
-    global servidores
-
     while True:
         print("\n--- MENÚ SERVIDORES Y SERVICIOS ---")
         print("1) Listar servidores")
         print("2) Mostrar detalle de un servidor")
+        print("3) Retirar un servicio de un servidor")
         print("0) Volver")
 
         opcion = input("Seleccione una opción: ").strip()
 
-        if opcion == '1':
-            print("\n--- Lista de servidores ---")
-            for s in servidores:
-                print(f"- {s.nombre} | IP: {s.ip}")
-
-        elif opcion == '2':
-            nombre = input("Ingrese el nombre del servidor: ").strip()
-            servidor = next((s for s in servidores if s.nombre.lower() == nombre.lower()), None)
-            if servidor:
-                print(f"\nServidor: {servidor.nombre}")
-                print(f"IP: {servidor.ip}")
+        try:
+            if opcion == '1':
+                print("\n--- Lista de servidores ---")
+                for s in listar_servidores():
+                    print(f"- {s['nombre']} | IP: {s['ip']}")
+
+            elif opcion == '2':
+                nombre = input("Ingrese el nombre del servidor: ").strip()
+                servidor = detalle_servidor(nombre)
+                print(f"\nServidor: {servidor['nombre']}")
+                print(f"IP: {servidor['ip']}")
                 print("Servicios brindados:")
-                for serv in servidor.servicios:
-                    print(f"  - {serv.nombre} | Protocolo: {serv.protocolo} | Puerto: {serv.puerto}")
+                for serv in servidor['servicios']:
+                    print(f"  - {serv['nombre']} | Protocolo: {serv['protocolo']} | Puerto: {serv['puerto']}")
+
+            elif opcion == '3':
+                nombre = input("Ingrese el nombre del servidor: ").strip()
+                detalle_servidor(nombre)
+                nombre_servicio = input("Servicio a retirar: ")
+                retirar_servicio(nombre, nombre_servicio)
+                print("Servicio retirado.")
+
+            elif opcion == '0':
+                break
             else:
-                print("Servidor no encontrado.")
-
-        elif opcion == '0':
-            break
-        else:
-            print("Opción inválida.")
-
-
+                print("Opción inválida.")
+        except OperacionInvalida as e:
+            print(e)
+
+
+#opcion 6 menu politicas
+def menu_politicas():
+    print("1) Verificar acceso de un alumno")
+    print("2) Auditoría completa")
+    if input("Seleccione una opción: ").strip() == '2':
+        archivo = input("Archivo del reporte (.csv o .json): ").strip()
+        try:
+            resumen = auditar_politicas(archivo)
+        except OperacionInvalida as e:
+            print(f" {e}")
+            return
+        print(f" {resumen['accesos']} accesos de {resumen['alumnos']} alumnos; "
+              f"{resumen['no_autorizadas']} conexiones no autorizadas y {resumen['obsoletas']} obsoletas "
+              f"({resumen['duracion']:.2f} s). Reporte en {archivo}.")
+        return
+    try:
+        cod_alumno = int(input("Código del alumno: ").strip())
+    except ValueError:
+        print("Código de alumno inválido.")
+        return
+    nombre_servidor = input("Nombre del servidor: ").strip()
+    nombre_servicio = input("Nombre del servicio: ").strip()
+    if verificar_politicas([[cod_alumno, nombre_servidor, nombre_servicio]])[0]:
+        print(" El alumno tiene acceso a ese servicio.")
+    else:
+        print(" El alumno NO tiene acceso a ese servicio.")
+
+
+@instrumentado('alumno_puede_conectarse')
 def alumno_puede_conectarse(cod_alumno, servidor, servicio):
-    for curso in cursos:
-        if curso.estado != "DICTANDO":
-            continue
-        if cod_alumno not in curso.alumnos:
-            continue
-        for s in curso.servidores:  # <- cada s es un dict
-            if s['nombre'].lower() == servidor.lower():
-                if servicio.lower() in [srv.lower() for srv in s['servicios_permitidos']]:
-                    return True
+    if indice_politicas.permitido(cod_alumno, servidor, servicio):
+        return True
     print(f" El alumno {cod_alumno} no tiene acceso al servicio {servicio} en el servidor {servidor}.")
     return False
 
 
-def build_arp_flow(handler, dpid, ip_src, ip_dst, out_port, sentido="arp"):
+def build_arp_flow(handler, dpid, ip_src, ip_dst, out_port, sentido="arp", mac_src=None, mac_dst=None):
     """
-    Flow para permitir ARP entre hosts.
+    Flow para permitir ARP entre hosts. Los campos en None no entran al match.
     """
     flow = {
         "switch": dpid,
         "name": f"{handler}_{sentido}",
         "priority": "32769",  # Priorizamos ARP
         "eth_type": "0x0806",  # ARP
-        "arp_spa": ip_src,  # IP de origen
-        "arp_tpa": ip_dst,  # IP de destino
+    }
+    for campo, valor in (("eth_src", mac_src), ("eth_dst", mac_dst),  # MAC de origen / destino
+                         ("arp_spa", ip_src), ("arp_tpa", ip_dst)):  # IP de origen / destino
+        if valor:
+            flow[campo] = valor
+    flow.update({
+        "cookie": str(COOKIE_FLOWS),  # Marca de flow propio
         "active": "true",
         "actions": f"output={out_port}"  # Acción de salida
-    }
+    })
     return flow
 
-def build_flow(handler, dpid, mac_src, ip_src, mac_dst, ip_dst, tcp_port, out_port, sentido="fw"):
+def build_flow(handler, dpid, mac_src, ip_src, mac_dst, ip_dst, tcp_port, out_port, sentido="fw",
+               ip_proto="0x06", campo_puerto="tcp_dst"):
     """
     Construye un flow para tráfico de L3 (IP) y L4 (TCP/UDP).
+    `campo_puerto` es tcp_dst, tcp_src, udp_dst o udp_src según protocolo y sentido.
+    Los campos de dirección en None no entran al match.
     """
     flow = {
         "switch": dpid,  # DPID del switch
         "name": f"{handler}_{sentido}",  # Flow name (handler + dirección)
         "priority": "32768",  # Prioridad del flow
         "eth_type": "0x0800",  # Tipo de Ethernet: IPv4
-        "ipv4_src": ip_src,  # Dirección IP de origen
-        "ipv4_dst": ip_dst,  # Dirección IP de destino
-        "ip_proto": "0x06",  # Protocolo: TCP
-        "tcp_dst": tcp_port,  # Puerto TCP de destino (puede cambiar según servicio)
+    }
+    for campo, valor in (("eth_src", mac_src), ("eth_dst", mac_dst),  # MAC de origen / destino
+                         ("ipv4_src", ip_src), ("ipv4_dst", ip_dst)):  # IP de origen / destino
+        if valor:
+            flow[campo] = valor
+    flow.update({
+        "ip_proto": ip_proto,  # Protocolo: 0x06 TCP, 0x11 UDP
+        campo_puerto: tcp_port,  # Puerto (o prefijo "valor/máscara") del servicio
+        "cookie": str(COOKIE_FLOWS),  # Marca de flow propio
         "active": "true",  # Flow activo
         "actions": f"output={out_port}"  # Acción: salida por el puerto
-    }
+    })
     return flow
 
 
+def nombre_flow_compartido(tipo: str, *claves) -> str:
+    """
+    Nombre determinista de un flow compartido: el mismo match produce el mismo
+    nombre en todas las conexiones. Lleva un prefijo de 8 hex como los
+    handlers para que la reconciliación lo reconozca como propio.
+    """
+    resumen = hashlib.sha1("|".join(str(c) for c in (tipo,) + claves).encode()).hexdigest()[:8]
+    return f"{resumen}_{tipo}"
+
+
+def es_flow_compartido(nombre: str) -> bool:
+    return nombre.partition('_')[2].startswith('agg_')
+
+
+def construir_flows_agregados(dpid, out_port, ip_servidor, mac_alumno, puerto_alumno, espec, transito=False):
+    """
+    Flows de una conexión en modo agregación en un switch del camino:
+    `out_port` lleva hacia el servidor y `puerto_alumno` hacia el alumno.
+
+    - fw: en el switch del alumno, uno por (MAC del alumno, servidor,
+      protocolo, prefijo de puerto) con match por eth_src: es el que aplica
+      la política. En los switches de tránsito (`transito`), donde se entra
+      por un enlace entre switches y el borde ya filtró, uno por (puerto de
+      entrada, servidor, protocolo, prefijo de puerto), compartido por todos
+      los alumnos que llegan por ese enlace.
+    - bw: uno por (MAC del alumno, servidor, protocolo, prefijo de puerto),
+      con match por eth_dst: la vuelta debe distinguir al alumno, que
+      comparte el puerto de salida con otros.
+    - ARP: un par por servidor y switch, compartido por todos los alumnos; el
+      ARP del servidor sale por flood, que solo afecta a ARP y no al tráfico
+      de datos.
+    """
+    mac = mac_alumno.lower()
+    flows = []
+    for valor, mascara in espec.prefijos:
+        puerto = EspecServicio.valor_match(valor, mascara)
+        if transito:
+            ida = {"name": nombre_flow_compartido("agg_fw_port", dpid, puerto_alumno, ip_servidor,
+                                                  espec.ip_proto, puerto),
+                   "in_port": str(puerto_alumno)}
+        else:
+            ida = {"name": nombre_flow_compartido("agg_fw", dpid, mac, ip_servidor, espec.ip_proto, puerto),
+                   "eth_src": mac}
+        ida.update({
+            "switch": dpid,
+            "priority": "32768",
+            "eth_type": "0x0800",
+            "ipv4_dst": ip_servidor,
+            "ip_proto": espec.ip_proto,
+            f"{espec.campo}_dst": puerto,
+            "cookie": str(COOKIE_FLOWS),
+            "active": "true",
+            "actions": f"output={out_port}"
+        })
+        flows += [
+            ida,
+            {
+                "switch": dpid,
+                "name": nombre_flow_compartido("agg_bw", dpid, mac, ip_servidor, espec.ip_proto, puerto),
+                "priority": "32768",
+                "eth_type": "0x0800",
+                "eth_dst": mac,
+                "ipv4_src": ip_servidor,
+                "ip_proto": espec.ip_proto,
+                f"{espec.campo}_src": puerto,
+                "cookie": str(COOKIE_FLOWS),
+                "active": "true",
+                "actions": f"output={puerto_alumno}"
+            },
+        ]
+    return flows + [
+        {
+            "switch": dpid,
+            "name": nombre_flow_compartido("agg_arp_fw", dpid, ip_servidor),
+            "priority": "32769",
+            "eth_type": "0x0806",
+            "arp_tpa": ip_servidor,
+            "cookie": str(COOKIE_FLOWS),
+            "active": "true",
+            "actions": f"output={out_port}"
+        },
+        {
+            "switch": dpid,
+            "name": nombre_flow_compartido("agg_arp_bw", dpid, ip_servidor),
+            "priority": "32769",
+            "eth_type": "0x0806",
+            "in_port": out_port,
+            "arp_spa": ip_servidor,
+            "cookie": str(COOKIE_FLOWS),
+            "active": "true",
+            "actions": "output=flood"
+        },
+    ]
+
+
+def reporte_agregacion() -> Dict[str, int]:
+    """
+    Flows instalados frente a los que ocuparía el esquema por handler. En cada
+    switch del camino una conexión usa tantos flows agregados como usaría por
+    handler (fw/bw por prefijo de puerto más el par ARP), así que ese esquema
+    instalaría una copia por referencia; las conexiones antiguas sin flows
+    registrados cuentan con sus 4 flows de siempre.
+    """
+    referencias, distintos, sin_flows = conexiones.conteo_flows()
+    por_handler = referencias + 4 * sin_flows
+    distintos += 4 * sin_flows
+    return {'conexiones': len(conexiones), 'flows_por_handler': por_handler,
+            'flows_instalados': distintos, 'referencias': referencias,
+            'ahorro': por_handler - distintos}
+
+
+def construir_flows_conexion(handler, dpid, out_port, ip_servidor, mac_alumno, espec,
+                             puerto_alumno=1, sufijo=""):
+    """
+    Devuelve los flows (fw, bw, arp_fw, arp_bw) de una conexión en un switch:
+    `out_port` lleva hacia el servidor y `puerto_alumno` hacia el alumno. La
+    ida hace match por la MAC del alumno y la IP del servidor, la vuelta por
+    la IP del servidor y la MAC del alumno como destino. Si el servicio tiene
+    varios prefijos de puerto, hay un par fw/bw por prefijo (el primero
+    conserva los nombres sin sufijo _p<n>).
+    """
+    flows = []
+    for i, (valor, mascara) in enumerate(espec.prefijos):
+        puerto = EspecServicio.valor_match(valor, mascara)
+        prefijo = f"_p{i}" if i else ""
+        flows += [
+            build_flow(handler, dpid, mac_alumno, None, None, ip_servidor, puerto, out_port,
+                       sentido=f"fw{sufijo}{prefijo}", ip_proto=espec.ip_proto, campo_puerto=f"{espec.campo}_dst"),
+            build_flow(handler, dpid, None, ip_servidor, mac_alumno, None, puerto, puerto_alumno,
+                       sentido=f"bw{sufijo}{prefijo}", ip_proto=espec.ip_proto, campo_puerto=f"{espec.campo}_src"),
+        ]
+    # ARP: las consultas del alumno por el servidor y las respuestas del servidor al alumno
+    return flows + [
+        build_arp_flow(handler, dpid, None, ip_servidor, out_port, sentido=f"arp_fw{sufijo}", mac_src=mac_alumno),
+        build_arp_flow(handler, dpid, ip_servidor, None, puerto_alumno, sentido=f"arp_bw{sufijo}",
+                       mac_dst=mac_alumno),
+    ]
+
+
+def nombres_flows_conexion(conexion) -> List[str]:
+    """Nombres de los flows instalados para una conexión registrada."""
+    if conexion.get('flows'):
+        return [f['name'] for f in conexion['flows']]
+    handler = conexion['handler']
+    return [f"{handler}_fw", f"{handler}_bw", f"{handler}_arp_fw", f"{handler}_arp_bw"]
+
+
+def preparar_flows(handler, mac_alumno, servidor, nombre_servicio) -> Optional[List[dict]]:
+    """
+    Arma los flows de una conexión hacia `servidor`, o None si Floodlight no
+    conoce su punto de conexión o el servidor no ofrece el servicio.
+
+    Instala flows de ida y vuelta en cada switch del camino más corto entre
+    el alumno y el servidor. Si no se conoce el punto de conexión del alumno
+    o no hay camino, solo se usa el switch del servidor con retorno por el
+    puerto 1, como antes.
+    """
+    # Protocolo y puertos según la tabla de servicios del servidor
+    espec = registro.servicio(servidor.nombre, nombre_servicio)
+    if espec is None:
+        return None
+    # DPID y puerto de salida
+    dpid, out_port = get_attachment_point_by_ip(servidor.ip)
+    if not dpid or not out_port:
+        return None
+    dpid_alumno, puerto_alumno = get_attachment_point_by_mac(mac_alumno)
+    saltos = topologia.ruta(dpid_alumno, dpid) if dpid_alumno and puerto_alumno else None
+    if not saltos:
+        saltos, puerto_alumno = [(dpid, None, None)], 1
+
+    flows = []
+    for i, (dpid_salto, hacia_servidor, hacia_alumno) in enumerate(saltos):
+        if hacia_servidor is None:
+            hacia_servidor = out_port
+        if hacia_alumno is None:
+            hacia_alumno = puerto_alumno
+        if MODO_AGREGACION:
+            flows += construir_flows_agregados(dpid_salto, hacia_servidor, servidor.ip, mac_alumno,
+                                               hacia_alumno, espec, transito=i > 0)
+        else:
+            # El switch del servidor conserva los nombres de siempre (<handler>_fw, ...)
+            sufijo = "" if dpid_salto == dpid else f"_{i}"
+            flows += construir_flows_conexion(handler, dpid_salto, hacia_servidor, servidor.ip, mac_alumno,
+                                              espec, hacia_alumno, sufijo)
+    return flows
+
+
+# ===== flows en curso =====
+# Las altas y bajas envían sus flows a Floodlight sin tomar `lock_estado`.
+# Mientras tanto, los handlers y los nombres de flows que usan quedan
+# reservados: la reconciliación no los toca y un flow compartido (modo
+# agregación) que otra conexión está instalando no se borra. Los borrados de
+# flows compartidos se hacen bajo `lock_flows` para que decidir que un flow
+# está libre y borrarlo no se intercale con una reserva. Orden de locks:
+# `lock_estado` puede tomarse antes que `lock_flows`, nunca después.
+
+lock_flows = threading.Lock()
+handlers_en_curso: set = set()
+flows_reservados: collections.Counter = collections.Counter()
+
+
+@contextlib.contextmanager
+def flows_en_curso(handlers: Iterable[str], flows_por_conexion: Iterable[List[dict]] = ()):
+    """Reserva handlers y flows mientras se instalan o eliminan fuera de `lock_estado`."""
+    handlers = set(handlers)
+    nombres = collections.Counter(f['name'] for flows in flows_por_conexion for f in flows)
+    with lock_flows:
+        handlers_en_curso.update(handlers)
+        flows_reservados.update(nombres)
+    try:
+        yield nombres
+    finally:
+        with lock_flows:
+            handlers_en_curso.difference_update(handlers)
+            flows_reservados.subtract(nombres)
+            for nombre in nombres:
+                if flows_reservados[nombre] <= 0:
+                    del flows_reservados[nombre]
+
+
+def eliminar_flows_libres(nombres: Iterable[str], switches: Optional[Dict[str, str]] = None,
+                          excluir: Iterable[str] = (), propios: Optional[collections.Counter] = None) -> List[bool]:
+    """
+    Elimina los flows de `nombres` que ninguna conexión registrada (fuera de
+    `excluir`) ni ninguna instalación en curso (aparte de `propios`) usa.
+    """
+    nombres = set(nombres)
+    if not nombres:
+        return []
+    # Los flows por handler son de una sola conexión: solo los compartidos necesitan el lock
+    compartidos = any(es_flow_compartido(n) for n in nombres)
+    with lock_flows if compartidos else contextlib.nullcontext():
+        nombres -= conexiones.referenciados_por_otros(nombres, excluir)
+        if compartidos:
+            nombres -= (flows_reservados - (propios or collections.Counter())).keys()
+        return delete_flows_concurrente(sorted(nombres), switches=switches) if nombres else []
+
+
+def eliminar_flows_huerfanos(conexiones_removidas: Iterable[dict]) -> Tuple[int, int]:
+    """
+    Elimina de Floodlight los flows de las conexiones removidas que ninguna
+    otra conexión sigue usando. Devuelve (eliminados_ok, total).
+    """
+    conexiones_removidas = list(conexiones_removidas)
+    nombres = {nombre for c in conexiones_removidas for nombre in nombres_flows_conexion(c)}
+    estados = eliminar_flows_libres(nombres, switches_de(f for c in conexiones_removidas for f in c.get('flows') or ()),
+                                    excluir={c['handler'] for c in conexiones_removidas})
+    return estados.count(True), len(estados)
+
+
+def instalar_conexiones_atomicas(flows_por_conexion: List[List[dict]], prioridad: int = PRIORIDAD_CREAR,
+                                 propios: Optional[collections.Counter] = None) -> List[bool]:
+    """
+    Instala los flows de varias conexiones como transacciones independientes.
+
+    Todos los flows se envían en paralelo; si alguno de una conexión falla se
+    eliminan todos los flows de esa conexión (también los que reportaron error,
+    porque un timeout puede ocultar un POST que sí se aplicó), de modo que no
+    quedan conexiones a medio instalar ocupando TCAM. Los flows compartidos
+    del modo agregación solo se revierten si nadie más los usa; `propios` son
+    las reservas de flows_en_curso() hechas por quien llama.
+    """
+    # Los flows compartidos se envían una sola vez, y no se envían si otra
+    # conexión registrada ya los usa (ya están instalados)
+    unicos = {}
+    for flows in flows_por_conexion:
+        for flow in flows:
+            unicos.setdefault(flow['name'], flow)
+    existentes = conexiones.referenciados_por_otros(unicos, ())
+    a_enviar = [flow for nombre, flow in unicos.items() if nombre not in existentes]
+    estados = dict(zip((f['name'] for f in a_enviar), push_flows_concurrente(a_enviar, prioridad))) if a_enviar else {}
+
+    exitos = [all(estados.get(flow['name'], True) for flow in flows) for flows in flows_por_conexion]
+
+    # No se revierte un flow que usa otra conexión ya registrada o exitosa
+    protegidos = set(existentes)
+    for flows, ok in zip(flows_por_conexion, exitos):
+        if ok:
+            protegidos.update(flow['name'] for flow in flows)
+    a_revertir = sorted({flow['name'] for flows, ok in zip(flows_por_conexion, exitos) if not ok
+                         for flow in flows} - protegidos)
+
+    if a_revertir:
+        print(f" Revirtiendo {len(a_revertir)} flows de {exitos.count(False)} conexiones incompletas.")
+        eliminar_flows_libres(a_revertir, switches_de(unicos.values()), propios=propios)
+    return exitos
+
+
+@instrumentado('crear_conexion')
+def crear_conexion(cod_alumno, nombre_servidor, nombre_servicio) -> str:
+    """
+    Crea una conexión instalando sus flows como una unidad.
+    Solo se registra en `conexiones` si todos los flows quedaron instalados.
+    Devuelve el handler; si no se pudo crear lanza OperacionInvalida.
+
+    `lock_estado` se toma solo para validar y para registrar; los flows viajan
+    a Floodlight sin él, así que el permiso se vuelve a comprobar al registrar.
+    """
+    with lock_estado:
+        # Validar si el alumno tiene acceso al servicio
+        if not alumno_puede_conectarse(cod_alumno, nombre_servidor, nombre_servicio):
+            raise OperacionInvalida(" Alumno NO autorizado para este servicio.")
+
+        # Obtener los datos necesarios para los flows
+        servidor = registro.servidor(nombre_servidor)
+        alumno = registro.alumno(cod_alumno)
+        if not servidor or not alumno:
+            raise NoEncontrado(" Servidor o alumno no registrado.")
+        if registro.servicio(nombre_servidor, nombre_servicio) is None:
+            raise OperacionInvalida(f" El servidor {nombre_servidor} no ofrece el servicio {nombre_servicio}.")
+
+    # Asignar un handler único para la conexión
+    handler = str(uuid.uuid4())[:8]
+    flows = preparar_flows(handler, alumno.mac, servidor, nombre_servicio)
+    if flows is None:
+        raise OperacionInvalida("Error: No se pudo obtener el DPID o puerto del servidor desde Floodlight.")
+    with flows_en_curso([handler], [flows]) as propios:
+        if not instalar_conexiones_atomicas([flows], propios=propios)[0]:
+            raise OperacionInvalida(" No se pudo instalar la conexión; se revirtieron sus flows.")
+        with lock_estado:
+            vigente = alumno_puede_conectarse(cod_alumno, nombre_servidor, nombre_servicio)
+            if vigente:
+                conexiones.agregar({'handler': handler, 'alumno': cod_alumno, 'servidor': nombre_servidor,
+                                    'servicio': nombre_servicio, 'flows': flows})
+        if not vigente:
+            eliminar_flows_libres((f['name'] for f in flows), switches_de(flows), propios=propios)
+            raise OperacionInvalida(" El permiso se revocó durante la instalación; se revirtieron sus flows.")
+    return handler
+
+
+# Flows creados por esta herramienta: "<handler de 8 hex>_<sentido>". El
+# nombre solo sirve para agruparlos; lo que los identifica como propios es
+# COOKIE_FLOWS
+PATRON_FLOW_PROPIO = re.compile(r'^([0-9a-f]{8})_')
+
+
+def es_flow_marcado(entrada: Optional[dict]) -> bool:
+    """True si la entrada listada por Floodlight lleva COOKIE_FLOWS."""
+    if not entrada or entrada.get('cookie') is None:
+        return False
+    return _normalizar_valor(entrada['cookie']) == str(COOKIE_FLOWS)
+
+
+# Claves de un payload de static flow que no son match ni acciones
+CAMPOS_NO_MATCH = {'name', 'switch', 'active', 'actions', 'instructions', 'priority', 'cookie',
+                   'idle_timeout', 'hard_timeout', 'table'}
+
+
+def _normalizar_valor(valor) -> str:
+    """'0x0800', '2048' y 2048 son lo mismo; también con máscara ('0x1000/0xf000')."""
+    partes = []
+    for parte in str(valor).strip().lower().split('/'):
+        try:
+            partes.append(str(int(parte, 0)))
+        except ValueError:
+            partes.append(parte)
+    return "/".join(partes)
+
+
+def firma_flow(entrada: dict) -> Optional[tuple]:
+    """
+    (match, acciones, prioridad) normalizados de un flow, sea el payload que
+    enviamos o una entrada de /wm/staticflowpusher/list (con "match" e
+    "instructions" en Floodlight 1.x). None si no trae match ni acciones.
+    """
+    match = entrada.get('match')
+    if not isinstance(match, dict):
+        match = {k: v for k, v in entrada.items() if k not in CAMPOS_NO_MATCH}
+    acciones = entrada.get('actions')
+    if acciones is None:
+        instrucciones = entrada.get('instructions') or {}
+        acciones = (instrucciones.get('instruction_apply_actions') or {}).get('actions')
+    if not match and acciones is None:
+        return None
+    return (frozenset((k, _normalizar_valor(v)) for k, v in match.items()),
+            _normalizar_valor(acciones or ""), _normalizar_valor(entrada.get('priority', "")))
+
+
+def obtener_flows_controlador(entradas: Optional[Dict[str, dict]] = None) -> Optional[Dict[str, str]]:
+    """
+    Descarga los static flows de todos los switches, con una petición por
+    controlador en paralelo. Devuelve {nombre_flow: dpid} o None si algún
+    controlador no responde (reconciliar con una vista parcial borraría de más).
+    Si se pasa `entradas`, se llena con el contenido listado de cada flow.
+    """
+    flows = {}
+    for controlador, r in controladores.consultar_todos("/wm/staticflowpusher/list/all/json"):
+        try:
+            if isinstance(r, Exception):
+                raise r
+            if r.status_code != 200:
+                print(f" Error al listar flows en {controlador.nombre}: {r.text}")
+                return None
+            data = r.json()
+        except Exception as e:
+            print(f" No se pudo conectar a Floodlight ({controlador.nombre}): {e}")
+            return None
+        for dpid, lista in data.items():
+            for entrada in lista:
+                for nombre, contenido in entrada.items():
+                    flows[nombre] = dpid
+                    if entradas is not None and isinstance(contenido, dict):
+                        entradas[nombre] = contenido
+    return flows
+
+
+def reconciliar(dry_run: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Compara los flows esperados de `conexiones` con los static flows de
+    Floodlight y aplica solo la diferencia: instala los que faltan, reinstala
+    los modificados a mano (mismo nombre y switch pero otro match, acciones o
+    prioridad; el POST con el mismo nombre los reemplaza) y elimina los flows
+    propios (marcados con COOKIE_FLOWS) que no corresponden a ninguna
+    conexión. Los flows ajenos a la herramienta no se tocan, ni los de altas
+    y bajas en curso (flows_en_curso()); los que solo tienen nombre de handler
+    sin la marca (instalados por versiones anteriores o a mano) se informan
+    en 'sin_marca' pero no se borran.
+    """
+    inicio = time.perf_counter()
+    listados: Dict[str, dict] = {}
+    instalados = obtener_flows_controlador(listados)
+    if instalados is None:
+        return None
+
+    # El registro se lee después del listado: una alta cuyos flows ya figuran
+    # en él está registrada o sigue reservada
+    with lock_estado:
+        registradas = list(conexiones)
+        with lock_flows:
+            en_curso, reservados = set(handlers_en_curso), set(flows_reservados)
+
+    # Índice por prefijo de handler de lo que hay en el controlador
+    por_handler: Dict[str, set] = {}
+    for nombre in instalados:
+        m = PATRON_FLOW_PROPIO.match(nombre)
+        if m and m.group(1) not in en_curso and nombre not in reservados:
+            por_handler.setdefault(m.group(1), set()).add(nombre)
+
+    esperados = {}
+    for c in registradas:
+        if c['handler'] in en_curso:
+            continue
+        payloads = {f['name']: f for f in c.get('flows', [])}
+        for nombre in nombres_flows_conexion(c):
+            esperados[nombre] = payloads.get(nombre)
+
+    faltantes = [f for nombre, f in esperados.items()
+                 if f and (nombre not in instalados or f.get('switch') != instalados[nombre])]
+    modificados = []
+    for nombre, f in esperados.items():
+        if f and nombre in listados and f.get('switch') == instalados[nombre]:
+            actual = firma_flow(listados[nombre])
+            if actual is not None and actual != firma_flow(f):
+                modificados.append(f)
+    sin_payload = [nombre for nombre, f in esperados.items() if f is None and nombre not in instalados]
+    huerfanos = [nombre for nombres in por_handler.values() for nombre in nombres if nombre not in esperados]
+    sobrantes = [nombre for nombre in huerfanos if es_flow_marcado(listados.get(nombre))]
+    sin_marca = sorted(set(huerfanos) - set(sobrantes))
+
+    reporte = {
+        'faltantes': [f['name'] for f in faltantes],
+        'modificados': [f['name'] for f in modificados],
+        'sobrantes': sorted(sobrantes),
+        'sin_payload': sin_payload,
+        'sin_marca': sin_marca,
+        'dry_run': dry_run,
+        'instalados_ok': 0,
+        'eliminados_ok': 0,
+    }
+    if not dry_run:
+        if sobrantes:
+            reporte['eliminados_ok'] = eliminar_flows_libres(sobrantes, instalados).count(True)
+        if faltantes or modificados:
+            reporte['instalados_ok'] = push_flows_concurrente(faltantes + modificados).count(True)
+    reporte['duracion'] = time.perf_counter() - inicio
+    return reporte
+
+
+def imprimir_reporte_reconciliacion(reporte):
+    if reporte is None:
+        print(" Reconciliación no realizada: Floodlight no respondió.")
+        return
+    modo = "simulación" if reporte['dry_run'] else "aplicada"
+    print(f" Reconciliación ({modo}) en {reporte['duracion']:.2f} s: "
+          f"{len(reporte['faltantes'])} flows faltantes, {len(reporte['modificados'])} modificados, "
+          f"{len(reporte['sobrantes'])} sobrantes.")
+    for nombre in reporte['faltantes']:
+        print(f"  + {nombre}")
+    for nombre in reporte['modificados']:
+        print(f"  ~ {nombre}")
+    for nombre in reporte['sobrantes']:
+        print(f"  - {nombre}")
+    for nombre in reporte['sin_payload']:
+        print(f"  ? {nombre} (conexión sin payload registrado, no se puede reinstalar)")
+    for nombre in reporte['sin_marca']:
+        print(f"  ? {nombre} (sin la cookie de la herramienta, no se elimina)")
+    if not reporte['dry_run']:
+        print(f" Instalados: {reporte['instalados_ok']}, eliminados: {reporte['eliminados_ok']}.")
+
+
+class ReconciliadorPeriodico:
+    """Ejecuta `reconciliar` en segundo plano cada `intervalo` segundos."""
+    def __init__(self):
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self.ultimo_reporte = None
+
+    def activo(self) -> bool:
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self, intervalo: float = RECONCILIACION_INTERVALO, dry_run: bool = True):
+        if self.activo():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, args=(intervalo, dry_run), daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join()
+        self._hilo = None
+
+    def _bucle(self, intervalo, dry_run):
+        while not self._detener.wait(intervalo):
+            self.ultimo_reporte = reconciliar(dry_run)
+            imprimir_reporte_reconciliacion(self.ultimo_reporte)
+
+
+reconciliador = ReconciliadorPeriodico()
+
+
+def solicitudes_de_curso(codigo_curso) -> List[Tuple[int, str, str]]:
+    """
+    Todas las combinaciones (alumno, servidor, servicio) que otorga un curso.
+    """
+    curso = registro.curso(codigo_curso)
+    if not curso:
+        return []
+    solicitudes = []
+    for cod in curso.alumnos:
+        for s in curso.servidores:
+            for srv in s.servicios_permitidos:
+                solicitudes.append((int(cod), s.nombre, srv))
+    return solicitudes
+
+
+def leer_solicitudes_archivo(nombre_archivo) -> List[Tuple[int, str, str]]:
+    """
+    Lee solicitudes (alumno, servidor, servicio) desde un CSV con cabecera
+    alumno,servidor,servicio o desde un YAML con una lista 'conexiones'.
+    """
+    with open(nombre_archivo, 'r', newline='') as f:
+        if nombre_archivo.lower().endswith('.csv'):
+            filas = list(csv.DictReader(f))
+        else:
+            data = yaml.safe_load(f) or []
+            filas = data.get('conexiones', []) if isinstance(data, dict) else data
+    return [(int(fila['alumno']), str(fila['servidor']).strip(), str(fila['servicio']).strip()) for fila in filas]
+
+
+def crear_conexiones_lote(solicitudes: Iterable[Tuple[int, str, str]]):
+    """
+    Aprovisiona muchas conexiones de una vez: valida todo contra el índice de
+    políticas, arma los flows y los envía en paralelo con un pool acotado.
+    Devuelve una lista con el resultado de cada solicitud.
+    """
+    inicio = time.perf_counter()
+    solicitudes = list(solicitudes)
+    # Una sola descarga de /wm/device/ y de los enlaces sirve a todo el lote
+    if not cache_dispositivos.vigente():
+        cache_dispositivos.refrescar()
+    if not topologia.vigente():
+        topologia.refrescar()
+    resultados = []
+    validas = []  # (resultado, alumno, servidor)
+    pendientes = []  # (resultado, flows)
+
+    with lock_estado:
+        permisos = indice_politicas.consultar_lote(solicitudes)
+        for (cod_alumno, nombre_servidor, nombre_servicio), permitido in zip(solicitudes, permisos):
+            resultado = {'alumno': cod_alumno, 'servidor': nombre_servidor, 'servicio': nombre_servicio,
+                         'handler': None, 'ok': False, 'error': None}
+            resultados.append(resultado)
+            servidor = registro.servidor(nombre_servidor)
+            alumno = registro.alumno(cod_alumno)
+            if not permitido:
+                resultado['error'] = "no autorizado"
+                continue
+            if servidor is None:
+                resultado['error'] = "servidor no registrado"
+                continue
+            if alumno is None:
+                resultado['error'] = "alumno no registrado"
+                continue
+            if registro.servicio(nombre_servidor, nombre_servicio) is None:
+                resultado['error'] = "el servidor no ofrece ese servicio"
+                continue
+            validas.append((resultado, alumno, servidor))
+
+    for resultado, alumno, servidor in validas:
+        handler = str(uuid.uuid4())[:8]
+        flows = preparar_flows(handler, alumno.mac, servidor, resultado['servicio'])
+        if flows is None:
+            resultado['error'] = "sin punto de conexión del servidor en Floodlight"
+            continue
+        resultado['handler'] = handler
+        pendientes.append((resultado, flows))
+
+    with flows_en_curso((r['handler'] for r, _ in pendientes), (flows for _, flows in pendientes)) as propios:
+        exitos = instalar_conexiones_atomicas([flows for _, flows in pendientes], PRIORIDAD_LOTE, propios)
+        revocadas = []
+        with lock_estado:
+            # El permiso se vuelve a comprobar: pudo cambiar mientras se instalaban los flows
+            instaladas = [(r, flows) for (r, flows), ok in zip(pendientes, exitos) if ok]
+            vigentes = indice_politicas.consultar_lote([(r['alumno'], r['servidor'], r['servicio'])
+                                                        for r, _ in instaladas])
+            for (resultado, flows), vigente in zip(instaladas, vigentes):
+                if vigente:
+                    resultado['ok'] = True
+                    conexiones.agregar({'handler': resultado['handler'], 'alumno': resultado['alumno'],
+                                        'servidor': resultado['servidor'], 'servicio': resultado['servicio'],
+                                        'flows': flows})
+                else:
+                    resultado['error'] = "permiso revocado durante la instalación (revertidos)"
+                    revocadas.extend(flows)
+        if revocadas:
+            eliminar_flows_libres((f['name'] for f in revocadas), switches_de(revocadas), propios=propios)
+    for resultado, ok in zip((r for r, _ in pendientes), exitos):
+        if not ok:
+            resultado['error'] = "fallo al instalar los flows (revertidos)"
+
+    duracion = time.perf_counter() - inicio
+    exitosas = sum(1 for r in resultados if r['ok'])
+    print(f" Lote procesado: {exitosas} conexiones creadas, {len(resultados) - exitosas} fallidas "
+          f"({sum(len(flows) for _, flows in pendientes)} flows en {duracion:.2f} s).")
+    stats = cache_dispositivos.estadisticas()
+    print(f" Caché de dispositivos: {stats['hits']} hits, {stats['misses']} misses, {stats['refrescos']} descargas.")
+    return resultados
+
+
+# ===== recomputación incremental de conexiones =====
+# Cada mutación de cursos, alumnos o servidores calcula, a través de los
+# índices inversos de `conexiones`, solo las conexiones afectadas y empuja o
+# elimina únicamente sus flows.
+
+def revocar_conexiones(handlers: Iterable[str], motivo: str = "") -> int:
+    """Elimina los flows de las conexiones indicadas y las saca del registro."""
+    afectadas = [c for c in (conexiones.obtener(h) for h in set(handlers)) if c]
+    if not afectadas:
+        return 0
+    # Se sacan del registro antes de borrar los flows: una conexión nueva que
+    # comparte un flow no debe darlo por instalado mientras se está borrando
+    for c in afectadas:
+        conexiones.eliminar(c['handler'])
+    removidos, total = eliminar_flows_huerfanos(afectadas)
+    print(f" {len(afectadas)} conexiones revocadas{f' ({motivo})' if motivo else ''}; "
+          f"{removidos}/{total} flows removidos.")
+    return len(afectadas)
+
+
+def revocar_no_permitidas(candidatas: Iterable[dict], motivo: str = "") -> int:
+    """Revoca, de las conexiones candidatas, las que ya no permite la política."""
+    candidatas = list(candidatas)
+    permisos = indice_politicas.consultar_lote([(c['alumno'], c['servidor'], c['servicio']) for c in candidatas])
+    return revocar_conexiones([c['handler'] for c, ok in zip(candidatas, permisos) if not ok], motivo)
+
+
+def recalcular_conexiones(candidatas: Iterable[dict]) -> int:
+    """
+    Vuelve a armar los flows de las conexiones indicadas y empuja solo los que
+    cambiaron. Como los flows se identifican por nombre, un POST con el mismo
+    nombre reemplaza al anterior; los nombres que dejan de existir se eliminan.
+    """
+    cambios, a_eliminar, actualizadas = [], [], []
+    switches: Dict[str, str] = {}
+    for c in candidatas:
+        servidor = registro.servidor(c['servidor'])
+        alumno = registro.alumno(c['alumno'])
+        if servidor is None or alumno is None:
+            continue
+        nuevos = preparar_flows(c['handler'], alumno.mac, servidor, c['servicio'])
+        if nuevos is None:
+            continue
+        anteriores = {f['name']: f for f in c.get('flows', [])}
+        cambios.extend(f for f in nuevos if anteriores.get(f['name']) != f)
+        a_eliminar.extend(set(anteriores) - {f['name'] for f in nuevos})
+        switches.update(switches_de(anteriores.values()))
+        actualizadas.append(dict(c, flows=nuevos))
+
+    cambios = list({f['name']: f for f in cambios}.values())
+    # Un flow que deja de usarse solo se borra si ninguna otra conexión lo referencia
+    en_uso = {f['name'] for c in actualizadas for f in c['flows']}
+    a_eliminar = set(a_eliminar) - en_uso
+    estados = push_flows_concurrente(cambios) if cambios else []
+    for c in actualizadas:
+        conexiones.actualizar(c)
+    a_eliminar = eliminar_flows_libres(a_eliminar, switches)
+    if cambios or a_eliminar:
+        print(f" Flows recalculados: {estados.count(True)}/{len(cambios)} actualizados, {len(a_eliminar)} eliminados.")
+    return len(cambios)
+
+
+def evento_alumno_agregado(curso, cod_alumno):
+    indice_politicas.agregar_alumno(curso, cod_alumno)
+
+
+def evento_alumno_retirado(curso, cod_alumno):
+    indice_politicas.quitar_alumno(curso, cod_alumno)
+    revocar_no_permitidas(conexiones.de_alumno(cod_alumno), f"alumno {cod_alumno} retirado de {curso.codigo}")
+
+
+def evento_alumno_eliminado(cod_alumno):
+    revocar_conexiones(conexiones.handlers_de_alumno(cod_alumno), f"alumno {cod_alumno} eliminado")
+
+
+def evento_estado_curso(curso, estado_nuevo):
+    indice_politicas.quitar_curso(curso)
+    curso.estado = sys.intern(estado_nuevo)
+    indice_politicas.agregar_curso(curso)
+    if estado_nuevo != "DICTANDO":
+        revocar_no_permitidas(conexiones.de_curso(curso), f"curso {curso.codigo} {estado_nuevo}")
+
+
+def evento_mac_actualizada(cod_alumno):
+    recalcular_conexiones(conexiones.de_alumno(cod_alumno))
+
+
+def evento_servidor_modificado(servidor):
+    """El servidor cambió de IP o de servicios: revoca lo que ya no ofrece y recalcula el resto."""
+    registro.indexar_servicios(servidor)
+    ofrecidos = {srv.nombre.lower() for srv in servidor.servicios}
+    afectadas = conexiones.de_servidor(servidor.nombre)
+    revocar_conexiones([c['handler'] for c in afectadas if c['servicio'].lower() not in ofrecidos],
+                       f"servicio retirado de {servidor.nombre}")
+    recalcular_conexiones(c for c in afectadas if c['servicio'].lower() in ofrecidos)
+
+
+# ===== auditoría de políticas =====
+# La matriz de acceso se calcula con un bitmap (int de Python) por
+# (servidor, servicio): el bit i es el i-ésimo alumno del registro. Cada curso
+# DICTANDO aporta el bitmap de sus alumnos a las claves que habilita y las
+# claves se combinan con OR, sin evaluar tupla por tupla.
+
+def _bitmaps_fragmento(n_bits: int, cursos) -> Dict[Tuple[str, str], int]:
+    """
+    Bitmaps por (servidor, servicio) de un fragmento de cursos, dados como
+    (claves, posiciones de sus alumnos). Corre también en los procesos del pool.
+    """
+    bitmaps: Dict[Tuple[str, str], int] = {}
+    for claves, posiciones in cursos:
+        bits = bytearray((n_bits + 7) // 8)
+        for pos in posiciones:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        bitmap = int.from_bytes(bits, 'little')
+        for clave in claves:
+            bitmaps[clave] = bitmaps.get(clave, 0) | bitmap
+    return bitmaps
+
+
+def _posiciones_bitmap(bitmap: int):
+    """Posiciones de los bits encendidos, en orden."""
+    datos = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(datos):
+        while byte:
+            bajo = byte & -byte
+            yield i * 8 + bajo.bit_length() - 1
+            byte ^= bajo
+
+
+def matriz_acceso(procesos: int = 0):
+    """
+    Calcula la matriz de acceso. Devuelve (codigos, posicion, bitmaps): la
+    lista de alumnos en orden de bit, el índice inverso y el bitmap de cada
+    (servidor, servicio) en minúsculas. Con procesos=0 usa un pool de
+    procesos solo si hay al menos AUDITORIA_UMBRAL_PROCESOS matrículas.
+    """
+    codigos = list(registro.alumnos)
+    posicion = {cod: i for i, cod in enumerate(codigos)}
+    cursos = []
+    for curso in registro.cursos.values():
+        if curso.estado != "DICTANDO":
+            continue
+        claves = tuple({(s.clave, srv) for s in curso.servidores for srv in s.servicios})
+        if claves:
+            cursos.append((claves, [posicion[cod] for cod in curso.alumnos if cod in posicion]))
+
+    if procesos <= 0:
+        matriculas = sum(len(posiciones) for _, posiciones in cursos)
+        procesos = (os.cpu_count() or 1) if matriculas >= AUDITORIA_UMBRAL_PROCESOS else 1
+    procesos = min(procesos, len(cursos))
+    if procesos <= 1:
+        return codigos, posicion, _bitmaps_fragmento(len(codigos), cursos)
+
+    bitmaps: Dict[Tuple[str, str], int] = {}
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        fragmentos = [cursos[i::procesos] for i in range(procesos)]
+        for parcial in pool.map(_bitmaps_fragmento, itertools.repeat(len(codigos)), fragmentos):
+            for clave, bitmap in parcial.items():
+                bitmaps[clave] = bitmaps.get(clave, 0) | bitmap
+    return codigos, posicion, bitmaps
+
+
+class ReporteAuditoria:
+    """
+    Escribe el reporte de auditoría fila por fila en CSV o JSON, sin
+    acumularlo en memoria. En JSON las filas van en "accesos" y "hallazgos"
+    y al final un "resumen".
+    """
+    COLUMNAS = ('tipo', 'alumno', 'servidor', 'servicio', 'permitido', 'ofrecido', 'handler', 'motivo')
+    SECCIONES = ('accesos', 'hallazgos')
+
+    def __init__(self, f, formato: str):
+        self.f = f
+        self.formato = formato
+        self.abiertas = 0  # secciones JSON ya abiertas, en el orden de SECCIONES
+        self.primera = True
+        if formato == 'csv':
+            self.csv = csv.DictWriter(f, fieldnames=self.COLUMNAS, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def _abrir_seccion(self, seccion: str):
+        """Abre `seccion` y las anteriores que no tuvieron filas."""
+        while self.abiertas <= self.SECCIONES.index(seccion):
+            self.f.write(("{" if not self.abiertas else "\n],") + f'\n"{self.SECCIONES[self.abiertas]}": [')
+            self.abiertas += 1
+            self.primera = True
+
+    def fila(self, seccion: str, fila: dict):
+        if self.formato == 'csv':
+            self.csv.writerow(fila)
+            return
+        self._abrir_seccion(seccion)
+        self.f.write(("\n" if self.primera else ",\n") + json.dumps(fila, ensure_ascii=False))
+        self.primera = False
+
+    def cerrar(self, resumen: dict):
+        if self.formato == 'csv':
+            return
+        self._abrir_seccion(self.SECCIONES[-1])
+        self.f.write('\n],\n"resumen": ' + json.dumps(resumen, ensure_ascii=False) + "}\n")
+
+
+def auditar(archivo: str, formato: str = "", procesos: int = 0, incluir_denegados: bool = False) -> Dict[str, Any]:
+    """
+    Escribe en `archivo` la matriz de acceso alumno x servidor x servicio de
+    los cursos DICTANDO y la compara con `conexiones`: las conexiones sin
+    permiso son "no_autorizada" y las que apuntan a alumnos, servidores o
+    servicios que ya no existen, "obsoleta". Devuelve el resumen.
+    """
+    inicio = time.perf_counter()
+    formato = (formato or os.path.splitext(archivo)[1].lstrip('.') or 'csv').lower()
+    if formato not in ('csv', 'json'):
+        raise ValueError(f"formato no soportado: {formato}")
+    codigos, posicion, bitmaps = matriz_acceso(procesos)
+
+    def nombre_servidor(clave):
+        servidor = registro.servidor(clave)
+        return servidor.nombre if servidor else clave
+
+    resumen = {'alumnos': len(codigos), 'claves': 0, 'accesos': 0, 'no_autorizadas': 0, 'obsoletas': 0}
+    with escritura_atomica(archivo, newline='' if formato == 'csv' else None) as f:
+        reporte = ReporteAuditoria(f, formato)
+        claves = set(bitmaps) | (set(registro.servicios) if incluir_denegados else set())
+        resumen['claves'] = len(claves)
+        for clave in sorted(claves):
+            servidor, servicio = nombre_servidor(clave[0]), clave[1]
+            ofrecido = clave in registro.servicios
+            bitmap = bitmaps.get(clave, 0)
+            posiciones = range(len(codigos)) if incluir_denegados else _posiciones_bitmap(bitmap)
+            for pos in posiciones:
+                permitido = bool(bitmap >> pos & 1)
+                resumen['accesos'] += permitido
+                reporte.fila('accesos', {'tipo': 'acceso', 'alumno': codigos[pos], 'servidor': servidor,
+                                         'servicio': servicio, 'permitido': permitido, 'ofrecido': ofrecido})
+
+        for c in conexiones.recorrer():
+            clave = (c['servidor'].lower(), c['servicio'].lower())
+            motivo = None
+            if c['alumno'] not in posicion:
+                motivo = "alumno no registrado"
+            elif registro.servidor(c['servidor']) is None:
+                motivo = "servidor no registrado"
+            elif clave not in registro.servicios:
+                motivo = "el servidor ya no ofrece el servicio"
+            if motivo:
+                tipo = 'obsoleta'
+                resumen['obsoletas'] += 1
+            elif not bitmaps.get(clave, 0) >> posicion[c['alumno']] & 1:
+                tipo, motivo = 'no_autorizada', "sin curso DICTANDO que lo permita"
+                resumen['no_autorizadas'] += 1
+            else:
+                continue
+            reporte.fila('hallazgos', {'tipo': tipo, 'alumno': c['alumno'], 'servidor': c['servidor'],
+                                       'servicio': c['servicio'], 'handler': c['handler'], 'motivo': motivo})
+        resumen['duracion'] = time.perf_counter() - inicio
+        reporte.cerrar(resumen)
+    return resumen
+
+
+# ===== operaciones del núcleo =====
+# Funciones compartidas por los menús, la CLI y la API JSON-RPC. Reciben y
+# devuelven datos simples (serializables a JSON), señalan errores con
+# OperacionInvalida y toman `lock_estado` para que la API pueda atender
+# peticiones concurrentes sobre el mismo estado. Las que envían flows a
+# Floodlight (conexiones.crear/eliminar/lote/reconciliar) lo toman solo al
+# leer y escribir el registro, para no frenar a las demás con su red.
+
+class OperacionInvalida(Exception):
+    """Error de una operación del núcleo; el mensaje se muestra tal cual al usuario."""
+
+
+class NoEncontrado(OperacionInvalida):
+    """La entidad pedida no existe."""
+
+
+lock_estado = threading.RLock()
+
+
+def con_bloqueo(funcion):
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with lock_estado:
+            return funcion(*args, **kwargs)
+    return envoltura
+
+
+def _alumno_existente(codigo: int) -> Alumno:
+    alumno = registro.alumno(int(codigo))
+    if alumno is None:
+        raise NoEncontrado("Alumno no encontrado.")
+    return alumno
+
+
+def _mac_libre(mac: str):
+    """Una MAC identifica a un solo alumno: los flows hacen match por ella."""
+    titular = registro.alumno_por_mac(mac)
+    if titular is not None:
+        raise OperacionInvalida(f"La MAC {mac} ya pertenece al alumno {titular.codigo}.")
+
+
+def _curso_existente(codigo: str) -> Curso:
+    curso = registro.curso(codigo)
+    if curso is None:
+        raise NoEncontrado("Curso no encontrado.")
+    return curso
+
+
+def _servidor_existente(nombre: str) -> Servidor:
+    servidor = registro.servidor(nombre)
+    if servidor is None:
+        raise NoEncontrado("Servidor no encontrado.")
+    return servidor
+
+
+@con_bloqueo
+def importar_base(archivo: str) -> Dict[str, Any]:
+    """Importa un YAML o un snapshot (.snap), aplica su diario de cambios y devuelve los totales."""
+    inicio = time.perf_counter()
+    try:
+        if archivo.endswith(EXT_SNAPSHOT):
+            importar_snapshot(archivo)
+        else:
+            importar_yaml(archivo)
+        cambios = diario.vincular(archivo)
+    except (OSError, ValueError, KeyError, yaml.YAMLError) as e:
+        raise OperacionInvalida(f"No se pudo importar {archivo}: {e}")
+    return {'alumnos': len(registro.alumnos), 'cursos': len(registro.cursos),
+            'servidores': len(registro.servidores), 'cambios_diario': cambios,
+            'duracion': time.perf_counter() - inicio}
+
+
+@con_bloqueo
+def exportar_base(archivo: str) -> Dict[str, Any]:
+    """
+    Exporta a YAML o a snapshot (.snap) según la extensión. Sobre la base
+    vinculada solo agrega los cambios pendientes a su diario.
+    """
+    try:
+        if diario.vinculado(archivo):
+            cambios = len(diario.pendientes)
+            return {'duracion': diario.guardar(), 'incremental': True, 'cambios': cambios}
+        exportar = exportar_snapshot if archivo.endswith(EXT_SNAPSHOT) else exportar_yaml
+        duracion = exportar(archivo, *registro_como_listas())
+        diario.vincular(archivo, descartar=True)
+        return {'duracion': duracion, 'incremental': False}
+    except OSError as e:
+        raise OperacionInvalida(f"No se pudo exportar {archivo}: {e}")
+
+
+@con_bloqueo
+def compactar_base() -> dict:
+    """Guarda los cambios pendientes y reescribe la base vinculada completa, recortando su diario."""
+    if diario.base is None:
+        raise OperacionInvalida("No hay una base importada o exportada.")
+    diario.guardar()
+    diario.esperar()
+    diario.compactar_en_segundo_plano()
+    diario.esperar()
+    return diario.estadisticas()
+
+
+@con_bloqueo
+def listar_alumnos() -> List[dict]:
+    return [a.to_dict() for a in registro.alumnos.values()]
+
+
+@con_bloqueo
+def detalle_alumno(codigo: int) -> dict:
+    alumno = _alumno_existente(codigo)
+    return dict(alumno.to_dict(), cursos=sorted(c.codigo for c in registro.cursos_alumno(alumno.codigo)))
+
+
+@con_bloqueo
+def crear_alumno(codigo: int, nombre: str, mac: str) -> dict:
+    if registro.alumno(int(codigo)):
+        raise OperacionInvalida("Ya existe un alumno con ese código.")
+    _mac_libre(mac)
+    alumno = Alumno(nombre, int(codigo), mac)
+    registro.agregar_alumno(alumno)
+    diario.anotar({'op': 'alumno', 'dato': alumno.to_dict()})
+    return alumno.to_dict()
+
+
+@con_bloqueo
+def actualizar_alumno(codigo: int, nombre: str = "", mac: str = "") -> dict:
+    alumno = _alumno_existente(codigo)
+    if nombre:
+        alumno.nombre = nombre
+    if mac and mac.lower() != alumno.mac.lower():
+        _mac_libre(mac)
+        registro.actualizar_mac(alumno, mac)
+        evento_mac_actualizada(alumno.codigo)
+    diario.anotar({'op': 'alumno', 'dato': alumno.to_dict()})
+    return alumno.to_dict()
+
+
+@con_bloqueo
+def eliminar_alumno(codigo: int) -> dict:
+    """Borra al alumno, lo retira de sus cursos y revoca sus conexiones."""
+    alumno = _alumno_existente(codigo)
+    afectados = registro.eliminar_alumno(alumno.codigo)
+    for c in afectados:
+        indice_politicas.quitar_alumno(c, alumno.codigo)
+    evento_alumno_eliminado(alumno.codigo)
+    diario.anotar({'op': 'alumno_baja', 'codigo': alumno.codigo})
+    return {'codigo': alumno.codigo, 'cursos': [c.codigo for c in afectados]}
+
+
+@con_bloqueo
+def listar_cursos() -> List[dict]:
+    return [{'codigo': c.codigo, 'nombre': c.nombre, 'estado': c.estado} for c in registro.cursos.values()]
+
+
+@con_bloqueo
+def detalle_curso(codigo: str) -> dict:
+    return _curso_existente(codigo).to_dict()
+
+
+@con_bloqueo
+def matricular_alumno(curso: str, alumno: int) -> dict:
+    c = _curso_existente(curso)
+    alumno = int(alumno)
+    if alumno in c.alumnos:
+        raise OperacionInvalida("El alumno ya está en el curso.")
+    if not registro.alumno(alumno):
+        raise NoEncontrado("Alumno no registrado en el sistema.")
+    registro.matricular(c, alumno)
+    evento_alumno_agregado(c, alumno)
+    diario.anotar({'op': 'matricula', 'curso': c.codigo, 'alumno': alumno})
+    return {'curso': c.codigo, 'alumno': alumno}
+
+
+@con_bloqueo
+def retirar_alumno(curso: str, alumno: int) -> dict:
+    c = _curso_existente(curso)
+    alumno = int(alumno)
+    if alumno not in c.alumnos:
+        raise OperacionInvalida("El alumno no está en este curso.")
+    registro.retirar(c, alumno)
+    evento_alumno_retirado(c, alumno)
+    diario.anotar({'op': 'retiro', 'curso': c.codigo, 'alumno': alumno})
+    return {'curso': c.codigo, 'alumno': alumno}
+
+
+@con_bloqueo
+def cambiar_estado_curso(curso: str, estado: str) -> dict:
+    c = _curso_existente(curso)
+    estado = estado.strip().upper()
+    if not estado:
+        raise OperacionInvalida("Estado inválido.")
+    evento_estado_curso(c, estado)
+    diario.anotar({'op': 'estado', 'curso': c.codigo, 'estado': c.estado})
+    return {'curso': c.codigo, 'estado': c.estado}
+
+
+@con_bloqueo
+def listar_servidores() -> List[dict]:
+    return [{'nombre': s.nombre, 'ip': s.ip} for s in registro.servidores.values()]
+
+
+@con_bloqueo
+def detalle_servidor(nombre: str) -> dict:
+    return _servidor_existente(nombre).to_dict()
+
+
+@con_bloqueo
+def retirar_servicio(servidor: str, servicio: str) -> dict:
+    s = _servidor_existente(servidor)
+    restantes = [serv for serv in s.servicios if serv.nombre.lower() != servicio.strip().lower()]
+    if len(restantes) == len(s.servicios):
+        raise OperacionInvalida("El servidor no brinda ese servicio.")
+    s.servicios = restantes
+    evento_servidor_modificado(s)
+    diario.anotar({'op': 'servidor', 'dato': s.to_dict()})
+    return s.to_dict()
+
+
+@con_bloqueo
+def verificar_politicas(consultas: List[list]) -> List[bool]:
+    """Evalúa una lista de [alumno, servidor, servicio] contra el índice de políticas."""
+    try:
+        tuplas = [(int(a), str(srv), str(svc)) for a, srv, svc in consultas]
+    except (TypeError, ValueError):
+        raise OperacionInvalida("Cada consulta debe ser [alumno, servidor, servicio].")
+    return indice_politicas.consultar_lote(tuplas)
+
+
+@con_bloqueo
+def auditar_politicas(archivo: str, formato: str = "", procesos: int = 0, incluir_denegados: bool = False) -> dict:
+    """Matriz de acceso completa y conexiones no autorizadas u obsoletas, en CSV o JSON."""
+    try:
+        return auditar(archivo, formato, procesos, incluir_denegados)
+    except (OSError, ValueError) as e:
+        raise OperacionInvalida(f"No se pudo escribir la auditoría: {e}")
+
+
+@con_bloqueo
+def listar_conexiones() -> List[dict]:
+    return [{k: c[k] for k in ('handler', 'alumno', 'servidor', 'servicio')} for c in conexiones]
+
+
+def abrir_conexion(alumno: int, servidor: str, servicio: str) -> dict:
+    return {'handler': crear_conexion(int(alumno), servidor, servicio)}
+
+
+def eliminar_conexion(handler: str) -> dict:
+    with flows_en_curso([handler]):
+        with lock_estado:
+            c = conexiones.obtener(handler)
+            if c is None:
+                raise NoEncontrado("No se encontró el handler.")
+            conexiones.eliminar(handler)
+        # Los flows compartidos solo se eliminan si nadie más los usa
+        removidos, total = eliminar_flows_huerfanos([c])
+    return {'handler': handler, 'flows_removidos': removidos, 'flows_fallidos': total - removidos}
+
+
+def aprovisionar_lote(curso: str = "", archivo: str = "", solicitudes: Optional[List[list]] = None) -> List[dict]:
+    """Crea conexiones en lote desde un curso, un archivo YAML/CSV o una lista de solicitudes."""
+    if archivo:
+        try:
+            pedidas = leer_solicitudes_archivo(archivo)
+        except (OSError, ValueError, KeyError, yaml.YAMLError) as e:
+            raise OperacionInvalida(f"No se pudo leer el archivo de solicitudes: {e}")
+    elif curso:
+        with lock_estado:
+            pedidas = solicitudes_de_curso(curso)
+    else:
+        pedidas = [(int(a), str(srv), str(svc)) for a, srv, svc in solicitudes or []]
+    if not pedidas:
+        raise OperacionInvalida("No hay solicitudes para procesar.")
+    return crear_conexiones_lote(pedidas)
+
+
+def reconciliar_controlador(dry_run: bool = True) -> dict:
+    reporte = reconciliar(dry_run)
+    if reporte is None:
+        raise OperacionInvalida("Reconciliación no realizada: Floodlight no respondió.")
+    return reporte
+
+
+def ver_metricas() -> dict:
+    """Latencias, llamadas, errores y operaciones en vuelo de las rutas instrumentadas, y la cola de flows."""
+    return dict(metricas.como_dict(), cola_flows=controladores.estadisticas_colas())
+
+
+def reiniciar_metricas() -> dict:
+    metricas.reiniciar()
+    return {'reiniciadas': True}
+
+
+# Operaciones expuestas por la CLI ("grupo accion") y por JSON-RPC ("grupo.accion")
+OPERACIONES = {
+    'base.importar': importar_base,
+    'base.exportar': exportar_base,
+    'base.compactar': compactar_base,
+    'alumnos.listar': listar_alumnos,
+    'alumnos.detalle': detalle_alumno,
+    'alumnos.crear': crear_alumno,
+    'alumnos.actualizar': actualizar_alumno,
+    'alumnos.eliminar': eliminar_alumno,
+    'cursos.listar': listar_cursos,
+    'cursos.detalle': detalle_curso,
+    'cursos.matricular': matricular_alumno,
+    'cursos.retirar': retirar_alumno,
+    'cursos.estado': cambiar_estado_curso,
+    'servidores.listar': listar_servidores,
+    'servidores.detalle': detalle_servidor,
+    'servidores.retirar-servicio': retirar_servicio,
+    'politicas.verificar': verificar_politicas,
+    'politicas.auditar': auditar_politicas,
+    'conexiones.listar': listar_conexiones,
+    'conexiones.crear': abrir_conexion,
+    'conexiones.eliminar': eliminar_conexion,
+    'conexiones.lote': aprovisionar_lote,
+    'conexiones.reconciliar': reconciliar_controlador,
+    'metricas.ver': ver_metricas,
+    'metricas.reiniciar': reiniciar_metricas,
+}
+
+
 def menu_conexiones():
+    global MODO_AGREGACION
+
     while True:
         print("\n--- MENÚ CONEXIONES ---")
         print("1) Crear conexión")
         print("2) Listar conexiones")
         print("3) Eliminar conexión")
-        print("4) Volver")
+        print("4) Crear conexiones en lote")
+        print("5) Refrescar caché de dispositivos y topología")
+        print("6) Reconciliar con Floodlight")
+        print("7) Modo de agregación de flows")
+        print("8) Métricas")
+        print("0) Volver")
         op = input("Seleccione una opción: ").strip()
 
         if op == '1':
@@ -385,119 +3040,609 @@ def menu_conexiones():
             nombre_servidor = input("Nombre del servidor: ")
             nombre_servicio = input("Nombre del servicio: ")
 
-            # Validar si el alumno tiene acceso al servicio
-            if not alumno_puede_conectarse(cod_alumno, nombre_servidor, nombre_servicio):
-                print(" Alumno NO autorizado para este servicio.")
+            try:
+                handler = abrir_conexion(cod_alumno, nombre_servidor, nombre_servicio)['handler']
+            except OperacionInvalida as e:
+                print(e)
                 continue
-
-            # Asignar un handler único para la conexión
-            handler = str(uuid.uuid4())[:8]
-            conexiones.append({'handler': handler, 'alumno': cod_alumno, 'servidor': nombre_servidor, 'servicio': nombre_servicio})
             print(f" Conexión creada. Handler: {handler}")
 
-            # Obtener los datos necesarios para los flows
-            ip_servidor = next(s.ip for s in servidores if s.nombre == nombre_servidor)
-            mac_alumno = next(a.mac for a in alumnos if a.codigo == cod_alumno)
-
-            #DPID y puerto de salida
-            dpid, out_port = get_attachment_point_by_ip(ip_servidor)
-            if not dpid or not out_port:
-                print("Error: No se pudo obtener el DPID o puerto del servidor desde Floodlight.")
-                continue
-
-            puerto_servicio = 22 if nombre_servicio == "ssh" else 80  # Asumir puerto SSH o HTTP
-
-            # Crear el flow de alumno a servidor (forwarding)
-            flow_fw = build_flow(handler, dpid, mac_alumno, ip_servidor, mac_alumno, ip_servidor, puerto_servicio, out_port, sentido="fw")
-            push_flow(flow_fw)
-            print(f" Flow de Forwarding instalado: {flow_fw['name']}")
-
-            # Crear el flow de servidor a alumno (reverse flow)
-            flow_bw = build_flow(handler, dpid, mac_alumno, ip_servidor, mac_alumno, ip_servidor, puerto_servicio, 1, sentido="bw")
-            push_flow(flow_bw)
-            print(f" Flow de Reverse instalado: {flow_bw['name']}")
-
-            # Flujos ARP (para resolución de IPs)
-            flow_arp_fw = build_arp_flow(handler, dpid, ip_servidor, ip_servidor, out_port, sentido="arp_fw")
-            push_flow(flow_arp_fw)
-            print(f" Flow ARP Forward instalado: {flow_arp_fw['name']}")
-
-            flow_arp_bw = build_arp_flow(handler, dpid, ip_servidor, ip_servidor, 1, sentido="arp_bw")
-            push_flow(flow_arp_bw)
-            print(f" Flow ARP Reverse instalado: {flow_arp_bw['name']}")
-
         elif op == '2':
-            if not conexiones:
+            lista = listar_conexiones()
+            if not lista:
                 print("No hay conexiones creadas.")
             else:
-                for c in conexiones:
+                for c in lista:
                     print(f"Handler: {c['handler']}, Alumno: {c['alumno']}, Servidor: {c['servidor']}, Servicio: {c['servicio']}")
 
         elif op == '3':
             handler = input("Handler de la conexión a eliminar: ")
-            for i, c in enumerate(conexiones):
-                if c['handler'] == handler:
-                    # Eliminar los flows correspondientes en Floodlight
-                    delete_flow(f"{handler}_fw")
-                    delete_flow(f"{handler}_bw")
-                    delete_flow(f"{handler}_arp_fw")
-                    delete_flow(f"{handler}_arp_bw")
-
-                    # Eliminar la conexión de la lista
-                    conexiones.pop(i)
-                    print(" Conexión eliminada y flows removidos.")
-                    break
+            try:
+                resultado = eliminar_conexion(handler)
+            except OperacionInvalida as e:
+                print(f" {e}")
+                continue
+            if not resultado['flows_fallidos']:
+                print(" Conexión eliminada y flows removidos.")
             else:
-                print(" No se encontró el handler.")
+                print(f" Conexión eliminada; {resultado['flows_fallidos']} flows no se pudieron remover.")
 
         elif op == '4':
+            origen = input("Código de curso o archivo de solicitudes (.yaml/.csv): ").strip()
+            try:
+                if os.path.isfile(origen):
+                    resultados = aprovisionar_lote(archivo=origen)
+                else:
+                    resultados = aprovisionar_lote(curso=origen)
+            except OperacionInvalida as e:
+                print(f" {e}")
+                continue
+            for r in resultados:
+                estado = f"OK handler {r['handler']}" if r['ok'] else f"ERROR: {r['error']}"
+                print(f"  - {r['alumno']} -> {r['servidor']}/{r['servicio']}: {estado}")
+
+        elif op == '5':
+            stats = cache_dispositivos.estadisticas()
+            print(f" Caché: {stats['dispositivos']} dispositivos, {stats['hits']} hits, "
+                  f"{stats['misses']} misses, {stats['refrescos']} descargas.")
+            cache_dispositivos.invalidar()
+            if cache_dispositivos.refrescar():
+                print(f" Caché refrescada: {len(cache_dispositivos.por_mac)} dispositivos.")
+            topologia.invalidar()
+            if topologia.refrescar():
+                stats = topologia.estadisticas()
+                print(f" Topología: {stats['switches']} switches, {stats['enlaces']} enlaces, "
+                      f"{stats['rutas']} rutas en caché ({stats['cambios']} cambios detectados).")
+
+        elif op == '6':
+            print("1) Simular (dry-run)")
+            print("2) Aplicar")
+            print("3) Iniciar reconciliación periódica")
+            print("4) Detener reconciliación periódica")
+            accion = input("Seleccione acción: ").strip()
+            if accion in ('1', '2'):
+                imprimir_reporte_reconciliacion(reconciliar(dry_run=accion == '1'))
+            elif accion == '3':
+                try:
+                    intervalo = float(input(f"Intervalo en segundos ({RECONCILIACION_INTERVALO}): ").strip() or RECONCILIACION_INTERVALO)
+                except ValueError:
+                    print(" Intervalo inválido.")
+                    continue
+                dry_run = input("¿Solo simular? (s/n): ").strip().lower() != 'n'
+                reconciliador.iniciar(intervalo, dry_run)
+                print(" Reconciliación periódica iniciada.")
+            elif accion == '4':
+                reconciliador.detener()
+                print(" Reconciliación periódica detenida.")
+            else:
+                print("Opción inválida.")
+
+        elif op == '7':
+            reporte = reporte_agregacion()
+            print(f" Modo agregación: {'ACTIVO' if MODO_AGREGACION else 'inactivo'}")
+            print(f" {reporte['conexiones']} conexiones: {reporte['flows_instalados']} flows instalados frente a "
+                  f"{reporte['flows_por_handler']} con flows por handler (ahorro: {reporte['ahorro']}).")
+            if input("¿Cambiar de modo? (s/n): ").strip().lower() == 's':
+                MODO_AGREGACION = not MODO_AGREGACION
+                print(f" Modo agregación {'activado' if MODO_AGREGACION else 'desactivado'} para las nuevas conexiones.")
+
+        elif op == '8':
+            operaciones = ver_metricas()['operaciones']
+            if not operaciones:
+                print(" Aún no hay métricas.")
+            for nombre, m in sorted(operaciones.items()):
+                print(f"  - {nombre}: {m['llamadas']} llamadas, {m['errores']} errores, "
+                      f"promedio {m['promedio_ms']:.1f} ms, p99 <= {m['p99_ms']:.1f} ms")
+            for nombre, cola in controladores.estadisticas_colas().items():
+                print(f" Cola de flows de {nombre}: {cola['en_cola']} en cola, {cola['en_vuelo']} en vuelo, "
+                      f"{cola['por_segundo']:.1f} ops/s, {cola['fusionadas']} fusionadas, {cola['canceladas']} canceladas.")
+            archivo = input("Archivo JSON para guardarlas (vacío para omitir): ").strip()
+            if archivo:
+                try:
+                    with open(archivo, 'w') as f:
+                        json.dump(ver_metricas(), f, indent=2)
+                    print(f" Métricas guardadas en {archivo}.")
+                except OSError as e:
+                    print(f" No se pudieron guardar las métricas: {e}")
+
+        elif op == '0':
             break  # Volver al menú principal
 
         else:
             print(" Opción inválida.")
 
+class CacheDispositivos:
+    """
+    Caché de la tabla /wm/device/ de Floodlight indexada por IPv4 y por MAC.
+
+    Una sola descarga sirve todas las consultas hasta que vence el TTL o se
+    invalida explícitamente. Un fallo de búsqueda, o una descarga fallida, solo
+    vuelve a descargar si pasó al menos `min_refresco` segundos desde el último
+    intento, para que una IP desconocida o un controlador caído no provoquen
+    una descarga por consulta.
+    """
+    def __init__(self, ttl: float = DEVICE_CACHE_TTL, min_refresco: float = 2.0):
+        self.ttl = ttl
+        self.min_refresco = min_refresco
+        self.ultimo_intento = 0.0
+        self.por_ip: Dict[str, Tuple[str, int]] = {}
+        self.por_mac: Dict[str, Tuple[str, int]] = {}
+        self.actualizado = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.refrescos = 0
+        self._lock = threading.Lock()
+
+    def vigente(self) -> bool:
+        return self.actualizado > 0 and time.monotonic() - self.actualizado < self.ttl
+
+    def invalidar(self):
+        with self._lock:
+            self.actualizado = 0.0
+            self.ultimo_intento = 0.0
+
+    @instrumentado('descarga_dispositivos', fallido=lambda ok: not ok)
+    def refrescar(self) -> bool:
+        """Descarga /wm/device/ de todos los controladores a la vez y combina las tablas."""
+        self.ultimo_intento = time.monotonic()
+        dispositivos = []
+        respondieron = 0
+        for controlador, r in controladores.consultar_todos("/wm/device/"):
+            try:
+                if isinstance(r, Exception):
+                    raise r
+                if r.status_code != 200:
+                    print(f"Error al consultar Floodlight ({controlador.nombre}): {r.status_code}")
+                    continue
+                data = r.json()
+            except Exception as e:
+                print(f"Error al consultar Floodlight ({controlador.nombre}): {e}")
+                continue
+            respondieron += 1
+            # Según la versión, Floodlight devuelve una lista o {"devices": [...]}
+            dispositivos.extend(data.get("devices", []) if isinstance(data, dict) else data)
+        if not respondieron:
+            return False
+
+        por_ip, por_mac = {}, {}
+        for dev in dispositivos:
+            ap = dev.get("attachmentPoint", [])
+            if not ap:
+                continue
+            punto = (ap[0].get("switchDPID"), ap[0].get("port"))
+            for ip in dev.get("ipv4", []):
+                por_ip.setdefault(ip, punto)
+            for mac in dev.get("mac", []):
+                por_mac.setdefault(mac.lower(), punto)
+
+        with self._lock:
+            self.por_ip, self.por_mac = por_ip, por_mac
+            self.actualizado = time.monotonic()
+            self.refrescos += 1
+        return True
+
+    def _buscar(self, indice: str, clave: str):
+        if self.vigente():
+            punto = getattr(self, indice).get(clave)
+            if punto:
+                self.hits += 1
+                return punto
+        self.misses += 1
+        if time.monotonic() - self.ultimo_intento >= self.min_refresco:
+            self.refrescar()
+        return getattr(self, indice).get(clave, (None, None))
+
+    def punto_por_ip(self, ip):
+        return self._buscar('por_ip', ip)
+
+    def punto_por_mac(self, mac):
+        return self._buscar('por_mac', mac.lower())
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refrescos': self.refrescos,
+            'dispositivos': len(self.por_mac),
+            'vigente': self.vigente(),
+        }
+
+
+cache_dispositivos = CacheDispositivos()
+
+
+class TopologiaRed:
+    """
+    Grafo de enlaces entre switches de /wm/topology/links/json (la unión de
+    los enlaces que informa cada controlador).
+
+    `vecinos[dpid]` da, para cada switch vecino, el puerto local que lleva a
+    él. Los caminos más cortos (BFS, en saltos) se calculan bajo demanda y se
+    guardan por par de switches; la caché de caminos solo se descarta cuando
+    un refresco encuentra un conjunto de enlaces distinto. Tras un fallo no
+    se reintenta antes de `min_refresco` segundos.
+    """
+    def __init__(self, ttl: float = TOPOLOGIA_TTL, min_refresco: float = 2.0):
+        self.ttl = ttl
+        self.min_refresco = min_refresco
+        self.ultimo_intento = 0.0
+        self.vecinos: Dict[str, Dict[str, int]] = {}
+        self.firma = frozenset()
+        self.rutas: Dict[Tuple[str, str], Optional[list]] = {}
+        self.actualizado = 0.0
+        self.refrescos = 0
+        self.cambios = 0
+        self._lock = threading.Lock()
+
+    def vigente(self) -> bool:
+        return self.actualizado > 0 and time.monotonic() - self.actualizado < self.ttl
+
+    def invalidar(self):
+        with self._lock:
+            self.actualizado = 0.0
+
+    @instrumentado('descarga_topologia', fallido=lambda ok: not ok)
+    def refrescar(self) -> bool:
+        self.ultimo_intento = time.monotonic()
+        enlaces = []
+        for controlador, r in controladores.consultar_todos("/wm/topology/links/json"):
+            try:
+                if isinstance(r, Exception):
+                    raise r
+                if r.status_code != 200:
+                    print(f"Error al consultar la topología ({controlador.nombre}): {r.status_code}")
+                    return False
+                enlaces.extend(r.json())
+            except Exception as e:
+                print(f"Error al consultar la topología ({controlador.nombre}): {e}")
+                return False
+
+        # Cada enlace como (switch, puerto) -> (switch, puerto), en ambos sentidos si es bidireccional
+        firma = set()
+        for enlace in enlaces:
+            try:
+                origen = (enlace['src-switch'], int(enlace['src-port']))
+                destino = (enlace['dst-switch'], int(enlace['dst-port']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            firma.add((origen, destino))
+            if enlace.get('direction', 'bidirectional') == 'bidirectional':
+                firma.add((destino, origen))
+        firma = frozenset(firma)
+
+        with self._lock:
+            if firma != self.firma:
+                vecinos: Dict[str, Dict[str, int]] = {}
+                for (dpid, puerto), (vecino, _) in sorted(firma):
+                    vecinos.setdefault(dpid, {}).setdefault(vecino, puerto)
+                self.vecinos, self.firma, self.rutas = vecinos, firma, {}
+                self.cambios += 1
+            self.actualizado = time.monotonic()
+            self.refrescos += 1
+        return True
+
+    @staticmethod
+    def _bfs(vecinos, origen, destino) -> Optional[List[str]]:
+        if origen == destino:
+            return [origen]
+        previo = {origen: None}
+        cola = collections.deque([origen])
+        while cola:
+            actual = cola.popleft()
+            for siguiente in vecinos.get(actual, ()):
+                if siguiente in previo:
+                    continue
+                previo[siguiente] = actual
+                if siguiente == destino:
+                    camino = [destino]
+                    while previo[camino[-1]] is not None:
+                        camino.append(previo[camino[-1]])
+                    return camino[::-1]
+                cola.append(siguiente)
+        return None
+
+    def ruta(self, origen: str, destino: str) -> Optional[List[Tuple[str, Optional[int], Optional[int]]]]:
+        """
+        Camino más corto de `origen` a `destino` como (dpid, puerto hacia
+        destino, puerto hacia origen) por switch; en los extremos el puerto
+        hacia el host es None. Devuelve None si no hay camino.
+        """
+        if not self.vigente() and time.monotonic() - self.ultimo_intento >= self.min_refresco:
+            self.refrescar()
+        with self._lock:
+            if (origen, destino) in self.rutas:
+                return self.rutas[(origen, destino)]
+            vecinos, firma = self.vecinos, self.firma
+        camino = self._bfs(vecinos, origen, destino)
+        saltos = None
+        if camino:
+            saltos = [(dpid,
+                       vecinos[dpid][camino[i + 1]] if i + 1 < len(camino) else None,
+                       vecinos[dpid][camino[i - 1]] if i > 0 else None)
+                      for i, dpid in enumerate(camino)]
+        with self._lock:
+            if firma is self.firma:
+                # Ida y vuelta usan el mismo camino
+                self.rutas[(origen, destino)] = saltos
+                self.rutas[(destino, origen)] = [(d, b, a) for d, a, b in reversed(saltos)] if saltos else None
+        return saltos
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'switches': len(self.vecinos),
+            'enlaces': len(self.firma),
+            'rutas': len(self.rutas),
+            'refrescos': self.refrescos,
+            'cambios': self.cambios,
+            'vigente': self.vigente(),
+        }
+
+
+topologia = TopologiaRed()
+
+
+@instrumentado('get_attachment_point_by_ip', fallido=lambda punto: punto[0] is None)
 def get_attachment_point_by_ip(ip):
-    url = f"{BASE_URL}/wm/device/"
-    try:
-        r = requests.get(url)
-        if r.status_code == 200:
-            for dev in r.json():
-                if ip in dev.get("ipv4", []):
-                    ap = dev.get("attachmentPoint", [])
-                    if ap:
-                        return ap[0].get("switchDPID"), ap[0].get("port")
-    except Exception as e:
-        print(f"Error al consultar Floodlight: {e}")
-    return None, None
+    return cache_dispositivos.punto_por_ip(ip)
+
+
+@instrumentado('get_attachment_point_by_mac', fallido=lambda punto: punto[0] is None)
+def get_attachment_point_by_mac(mac):
+    return cache_dispositivos.punto_por_mac(mac)
 
 # ===== insertar y eliminar flows =====
-def push_flow(flow):
-    url = f"{BASE_URL}/wm/staticflowpusher/json"
-    headers = {"Content-Type": "application/json"}
+@instrumentado('push_flow', fallido=lambda ok: not ok)
+def push_flow(flow, silencioso=False, cliente=None):
+    cliente = cliente or controladores.para_dpid(flow.get('switch')).cliente
     try:
-        response = requests.post(url, json=flow, headers=headers)
+        response = cliente.post("/wm/staticflowpusher/json", flow)
         if response.status_code == 200:
-            print(" Flow instalado en Floodlight.")
-        else:
-            print(f" Error al instalar flow: {response.text}")
+            if not silencioso:
+                print(" Flow instalado en Floodlight.")
+            return True
+        print(f" Error al instalar flow {flow.get('name')}: {response.text}")
     except Exception as e:
         print(f" No se pudo conectar a Floodlight: {e}")
+    return False
 
 
-def delete_flow(flow_name):
-    url = f"{BASE_URL}/wm/staticflowpusher/json"
+@instrumentado('delete_flow', fallido=lambda ok: not ok)
+def delete_flow(flow_name, silencioso=False, cliente=None, dpid=None):
+    cliente = cliente or controladores.para_dpid(dpid).cliente
     data = {"name": flow_name}
-    headers = {"Content-Type": "application/json"}
     try:
-        response = requests.delete(url, json=data, headers=headers)
+        response = cliente.delete("/wm/staticflowpusher/json", data)
         if response.status_code == 200:
-            print(" Flow eliminado de Floodlight.")
-        else:
-            print(f" Error al eliminar flow: {response.text}")
+            if not silencioso:
+                print(" Flow eliminado de Floodlight.")
+            return True
+        print(f" Error al eliminar flow {flow_name}: {response.text}")
     except Exception as e:
         print(f" No se pudo conectar a Floodlight: {e}")
+    return False
+
+
+
+
+# ===== API JSON-RPC sobre HTTP =====
+
+def ejecutar_rpc(peticion) -> Optional[dict]:
+    """Atiende una petición JSON-RPC 2.0 (sin la capa HTTP). Devuelve None para notificaciones."""
+    id_peticion = peticion.get('id') if isinstance(peticion, dict) else None
+    if not isinstance(peticion, dict) or not isinstance(peticion.get('method'), str):
+        return {'jsonrpc': '2.0', 'id': id_peticion, 'error': {'code': -32600, 'message': "Petición inválida"}}
+    funcion = OPERACIONES.get(peticion['method'])
+    if funcion is None:
+        return {'jsonrpc': '2.0', 'id': id_peticion,
+                'error': {'code': -32601, 'message': f"Método desconocido: {peticion['method']}"}}
+    params = peticion.get('params') or {}
+    try:
+        resultado = funcion(*params) if isinstance(params, list) else funcion(**params)
+        respuesta = {'jsonrpc': '2.0', 'id': id_peticion, 'result': resultado}
+    except NoEncontrado as e:
+        respuesta = {'jsonrpc': '2.0', 'id': id_peticion, 'error': {'code': -32004, 'message': str(e)}}
+    except OperacionInvalida as e:
+        respuesta = {'jsonrpc': '2.0', 'id': id_peticion, 'error': {'code': -32000, 'message': str(e)}}
+    except (TypeError, ValueError) as e:
+        respuesta = {'jsonrpc': '2.0', 'id': id_peticion, 'error': {'code': -32602, 'message': f"Parámetros inválidos: {e}"}}
+    except Exception as e:
+        # Cualquier otro fallo queda en su respuesta; en un lote no arrastra a las demás
+        respuesta = {'jsonrpc': '2.0', 'id': id_peticion, 'error': {'code': -32603, 'message': f"Error interno: {e}"}}
+    return respuesta if 'id' in peticion else None
+
+
+class ServidorAPI:
+    """
+    Servidor HTTP/1.1 asyncio mínimo para la API local.
+
+    POST /rpc acepta JSON-RPC 2.0 (también en lote), GET /salud responde
+    el estado y GET /metricas expone las métricas en formato Prometheus.
+    Cada operación corre en un pool de hilos porque las llamadas a
+    Floodlight son bloqueantes; `lock_estado` serializa el acceso al estado
+    compartido entre peticiones concurrentes.
+    """
+    def __init__(self, host: str = API_HOST, puerto: int = API_PUERTO, hilos: int = MAX_WORKERS_LOTE):
+        self.host = host
+        self.puerto = puerto
+        self.pool = ThreadPoolExecutor(max_workers=hilos)
+
+    async def _responder(self, writer, estado: int, cuerpo):
+        if estado == 204:
+            # 204 no lleva cuerpo: un cliente keep-alive leería esos bytes como la siguiente respuesta
+            writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            await writer.drain()
+            return
+        if isinstance(cuerpo, str):
+            data, tipo = cuerpo.encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            data, tipo = json.dumps(cuerpo, ensure_ascii=False, default=str).encode(), "application/json"
+        razon = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[estado]
+        writer.write(f"HTTP/1.1 {estado} {razon}\r\nContent-Type: {tipo}\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _despachar(self, metodo: str, ruta: str, cuerpo: bytes):
+        if ruta == '/salud':
+            return 200, {'estado': 'ok', 'operaciones': sorted(OPERACIONES)}
+        if ruta == '/metricas':
+            return 200, metricas.exportar_prometheus() + controladores.exportar_prometheus()
+        if ruta != '/rpc':
+            return 404, {'error': f"Ruta desconocida: {ruta}"}
+        if metodo != 'POST':
+            return 405, {'error': "Use POST /rpc"}
+        try:
+            peticion = json.loads(cuerpo or b'null')
+        except ValueError:
+            return 200, {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': "JSON inválido"}}
+        loop = asyncio.get_running_loop()
+        if isinstance(peticion, list):
+            respuestas = await asyncio.gather(*(loop.run_in_executor(self.pool, ejecutar_rpc, p) for p in peticion))
+            respuestas = [r for r in respuestas if r is not None]
+        else:
+            respuestas = await loop.run_in_executor(self.pool, ejecutar_rpc, peticion)
+        return (200, respuestas) if respuestas else (204, None)
+
+    async def _atender(self, reader, writer):
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                metodo, ruta, _ = linea.decode('latin-1').split(' ', 2)
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b'\r\n', b'\n', b''):
+                        break
+                    clave, _, valor = cabecera.decode('latin-1').partition(':')
+                    cabeceras[clave.strip().lower()] = valor.strip()
+                cuerpo = await reader.readexactly(int(cabeceras.get('content-length', 0)))
+                estado, respuesta = await self._despachar(metodo, ruta.split('?', 1)[0], cuerpo)
+                await self._responder(writer, estado, respuesta)
+                if cabeceras.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def servir(self):
+        servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        print(f" API escuchando en http://{self.host}:{self.puerto}/rpc (métricas en /metricas)")
+        async with servidor:
+            await servidor.serve_forever()
+
+
+# ===== CLI =====
+
+def _argumentos_operacion(subparser, funcion):
+    """Declara los argumentos de una suborden a partir de la firma de la operación."""
+    for nombre, parametro in inspect.signature(funcion).parameters.items():
+        tipo = parametro.annotation
+        if tipo is bool:
+            subparser.add_argument(f"--{nombre.replace('_', '-')}", dest=nombre, action=argparse.BooleanOptionalAction,
+                                   default=parametro.default)
+        elif tipo not in (int, str):
+            # Listas: se reciben como JSON, p. ej. '[[20012482, "Servidor 1", "ssh"]]'
+            subparser.add_argument(f"--{nombre}", type=json.loads,
+                                   default=None if parametro.default is inspect.Parameter.empty else parametro.default,
+                                   required=parametro.default is inspect.Parameter.empty)
+        elif parametro.default is inspect.Parameter.empty:
+            subparser.add_argument(nombre, type=tipo)
+        else:
+            subparser.add_argument(f"--{nombre}", type=tipo, default=parametro.default)
+
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Network Policy manager de la UPSM")
+    parser.add_argument("-b", "--base", help="YAML o snapshot a importar antes de ejecutar la orden")
+    parser.add_argument("--guardar", action="store_true", help="exportar la base de vuelta a --base al terminar")
+    parser.add_argument("--controlador", help=f"URL de Floodlight (por defecto {BASE_URL})")
+    parser.add_argument("--controladores", metavar="ARCHIVO", default=CONTROLADORES_CONFIG,
+                        help="YAML/JSON con varios controladores y sus DPIDs")
+    parser.add_argument("--metricas", metavar="ARCHIVO", help="volcar las métricas en JSON al terminar")
+    parser.add_argument("--perfil", metavar="ARCHIVO",
+                        help="ejecutar la orden bajo cProfile y guardar las estadísticas (pstats)")
+    grupos = parser.add_subparsers(dest="grupo")
+    grupos.add_parser("menu", help="menú interactivo (por defecto)")
+    servir = grupos.add_parser("servir", help="levantar la API JSON-RPC local")
+    servir.add_argument("--host", default=API_HOST)
+    servir.add_argument("--puerto", type=int, default=API_PUERTO)
+
+    acciones_por_grupo: Dict[str, Any] = {}
+    for operacion, funcion in OPERACIONES.items():
+        grupo, accion = operacion.split('.', 1)
+        if grupo not in acciones_por_grupo:
+            acciones_por_grupo[grupo] = grupos.add_parser(grupo).add_subparsers(dest="accion", required=True)
+        sub = acciones_por_grupo[grupo].add_parser(accion, help=(funcion.__doc__ or "").strip().split("\n")[0])
+        sub.set_defaults(operacion=operacion)
+        _argumentos_operacion(sub, funcion)
+    return parser
+
+
+def perfilar(archivo: str, funcion, *args, **kwargs):
+    """Ejecuta una sola orden bajo cProfile; guarda las estadísticas y muestra las 20 más costosas."""
+    perfil = cProfile.Profile()
+    try:
+        return perfil.runcall(funcion, *args, **kwargs)
+    finally:
+        perfil.dump_stats(archivo)
+        pstats.Stats(perfil, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+        print(f" Perfil guardado en {archivo} (python -m pstats {archivo})", file=sys.stderr)
 
 
+def guardar_metricas(archivo: str) -> bool:
+    """Vuelca las métricas a `archivo`; si no se puede, lo informa por stderr y devuelve False."""
+    try:
+        with open(archivo, 'w') as f:
+            json.dump(metricas.como_dict(), f, indent=2)
+        return True
+    except OSError as e:
+        print(json.dumps({'error': f"Métricas: {e}"}, ensure_ascii=False), file=sys.stderr)
+        return False
+
+
+def main(argv=None) -> int:
+    args = crear_parser().parse_args(argv)
+    metricas_ok = True
+    if args.controlador:
+        configurar_controlador(args.controlador)
+    if args.controladores:
+        try:
+            cargar_controladores(args.controladores)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            print(json.dumps({'error': f"Controladores: {e}"}, ensure_ascii=False), file=sys.stderr)
+            return 1
+    try:
+        if args.base:
+            importar_base(args.base)
+        if args.grupo in (None, "menu"):
+            menu_principal()
+            return 0
+        if args.grupo == "servir":
+            asyncio.run(ServidorAPI(args.host, args.puerto).servir())
+            return 0
+
+        funcion = OPERACIONES[args.operacion]
+        kwargs = {nombre: getattr(args, nombre) for nombre in inspect.signature(funcion).parameters}
+        if args.perfil:
+            resultado = perfilar(args.perfil, funcion, **kwargs)
+        else:
+            resultado = funcion(**kwargs)
+        if args.guardar and args.base:
+            exportar_base(args.base)
+    except OperacionInvalida as e:
+        print(json.dumps({'error': str(e)}, ensure_ascii=False), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        # Que una compactación en curso termine antes de salir
+        diario.esperar()
+        if args.metricas:
+            metricas_ok = guardar_metricas(args.metricas)
+    print(json.dumps(resultado, ensure_ascii=False, indent=2, default=str))
+    return 0 if metricas_ok else 1
 
 
 def menu_principal():
@@ -517,12 +3662,26 @@ def menu_principal():
 
         if opcion == '1':
             archivo = input("Nombre de archivo a importar: ")
-            importar_yaml(archivo)
-            print(f"Importados {len(alumnos)} alumnos, {len(cursos)} cursos y {len(servidores)} servidores.")
+            try:
+                totales = importar_base(archivo)
+            except OperacionInvalida as e:
+                print(e)
+                continue
+            print(f"Importados {totales['alumnos']} alumnos, {totales['cursos']} cursos y "
+                  f"{totales['servidores']} servidores en {totales['duracion'] * 1000:.1f} ms.")
+            if totales['cambios_diario']:
+                print(f"Aplicados {totales['cambios_diario']} cambios del diario.")
         elif opcion == '2':
-            archivo = input("Nombre de archivo para exportar: ")
-            exportar_yaml(archivo, alumnos, cursos, servidores)
-            print("Archivo exportado correctamente.")
+            archivo = input(f"Nombre de archivo para exportar (.yaml o {EXT_SNAPSHOT}): ")
+            try:
+                resultado = exportar_base(archivo)
+            except OperacionInvalida as e:
+                print(e)
+                continue
+            if resultado['incremental']:
+                print(f"{resultado['cambios']} cambios guardados en el diario en {resultado['duracion'] * 1000:.1f} ms.")
+            else:
+                print(f"Archivo exportado correctamente en {resultado['duracion'] * 1000:.1f} ms.")
         elif opcion == '3':
             menu_cursos()
         elif opcion == '4':
@@ -530,7 +3689,7 @@ def menu_principal():
         elif opcion == '5':
             menu_servidores()
         elif opcion == '6':
-            break
+            menu_politicas()
         elif opcion == '7':
             menu_conexiones()
         elif opcion == '8':
@@ -541,4 +3700,4 @@ def menu_principal():
 
 
 if __name__ == "__main__":
-    menu_principal()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file